@@ -1,424 +1,510 @@
 import streamlit as st
+import io
+import multiprocessing
 import os
-import re
-import time
-import tempfile
-import csv 
-from datetime import datetime
-import google.generativeai as genai
-from requests.exceptions import ConnectionError
-from urllib3.exceptions import ProtocolError
-from google.api_core.exceptions import TooManyRequests
-from supabase import create_client, Client
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from file_poller import DEADLINE_SECONDS, BackgroundUploads, wait_for_files_active
+from gemini_client import (
+    FAILED_RESPONSES as RESPUESTAS_FALLIDAS,
+    PROMPT_VERSION,
+    choose_route,
+    context_cache_from_config,
+    count_tokens,
+    generate,
+    key_pool_from_config,
+    routes_from_config,
+)
+import metrics
+from questionnaire import (
+    DIARRHEA_QUESTION,
+    GENERAL_QUESTIONS,
+    LANGUAGES,
+    OWNER_QUESTIONS,
+    SPECIES_QUESTION,
+    TEXTS,
+    PromptBuilder,
+    species_code,
+    species_questions,
+    text,
+)
+from response_cache import DEFAULT_PATH as DEFAULT_CACHE_PATH, ResponseCache, response_cache_key
+from supabase_writer import (
+    DEFAULT_PATH as DEFAULT_QUEUE_PATH,
+    WriterOverloaded,
+    response_row,
+    supabase_writer_from_config,
+)
+from triage import LEVEL_ROUTINE, LEVEL_SOON, LEVEL_URGENT, SKIP_NEVER, should_skip_llm, triage
+from upload_cache import UploadCache, hash_video_bytes
+from video_ingest import VideoRejected, VideoSpool, inspect_video
+from video_preprocess import (
+    FFMPEG_TIMEOUT_SECONDS,
+    MODE_OFF,
+    PreprocessError,
+    ffmpeg_available,
+    preprocess_video,
+)
+
+# Los SDK de Gemini y Supabase tardan en importarse; se cargan dentro de las
+# funciones que los usan para que el arranque y los reruns no los paguen.
 
 # =================== Inicialización de Supabase ===================
-# Se obtienen las credenciales desde st.secrets
-SUPABASE_URL = st.secrets["supabase"]["url"]
-SUPABASE_KEY = st.secrets["supabase"]["key"]
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+def _writer_is_healthy(writer):
+    """
+    Validación que Streamlit ejecuta al entregar el escritor en caché; si su
+    hilo de fondo murió se crea uno nuevo, que retoma la cola local.
+    """
+    return writer.is_alive()
+
+@st.cache_resource(validate=_writer_is_healthy)
+def get_supabase_writer():
+    """
+    Escritor en segundo plano de la tabla "responses", uno por proceso.
+    Se obtienen las credenciales desde st.secrets.
+    """
+    return supabase_writer_from_config(
+        st.secrets["supabase"],
+        path=st.secrets.get("cache", {}).get("queue_path", DEFAULT_QUEUE_PATH),
+    )
+
+# =================== Métricas ===================
+@st.cache_resource
+def start_metrics_export():
+    """
+    Expone las métricas del proceso en formato Prometheus. Por defecto en
+    http://127.0.0.1:9464/metrics; st.secrets["metrics"] permite cambiar
+    host y port, o escribirlas en un archivo con path.
+    """
+    config = st.secrets.get("metrics", {})
+    if config.get("path"):
+        metrics.export_to_file(config["path"], interval=config.get("interval", 15))
+    if config.get("port", 9464):
+        try:
+            return metrics.serve(config.get("host", "127.0.0.1"), config.get("port", 9464))
+        except OSError:
+            # Otro proceso de la app ya tiene el puerto
+            return None
+    return None
+
+start_metrics_export()
+
+# =================== Imágenes estáticas ===================
+@st.cache_resource
+def load_image(path, max_width):
+    """
+    Decodifica la imagen una sola vez, la reduce a `max_width` píxeles de
+    ancho y la retorna como PNG en memoria para servirla en cada rerun.
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        if image.width > max_width:
+            alto = round(image.height * max_width / image.width)
+            image = image.resize((max_width, alto), Image.LANCZOS)
+        salida = io.BytesIO()
+        image.save(salida, format="PNG", optimize=True)
+    return salida.getvalue()
 
 # =================== Configuración de la API de Gemini ===================
 
-api_keys = [
-    st.secrets["gemini"]["key1"],
-    st.secrets["gemini"]["key2"]
-]
-
-current_api_key_index = 0
-
-def configure_api():
-    global current_api_key_index
-    genai.configure(api_key=api_keys[current_api_key_index])
-
-configure_api()
-
-generation_config = {
-    "temperature": 0.4,
-    "top_p": 0.8,
-    "top_k": 32,
-    "max_output_tokens": 8000,
-}
-
-safety_settings = [
-    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
-    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
-    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
-    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
-]
-
-def create_model():
-    return genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        generation_config=generation_config,
-        safety_settings=safety_settings
+@st.cache_resource
+def get_key_pool():
+    """
+    Pool de API keys del proceso, construido con todas las entradas `key*`
+    de st.secrets["gemini"]. Agregar una key solo requiere añadirla ahí.
+    """
+    return key_pool_from_config(st.secrets["gemini"])
+
+@st.cache_resource
+def get_context_cache():
+    """
+    Caché de contexto para el prefijo fijo del prompt, o None si el modo está
+    apagado. Se activa con st.secrets["gemini"]["context_cache"] = true.
+    """
+    return context_cache_from_config(st.secrets["gemini"])
+
+@st.cache_resource
+def get_routes():
+    """
+    Modelo, plazo y tope de tokens para cuestionarios sin video y con video.
+    Se ajustan en st.secrets["gemini"]["routes"]["text"|"media"].
+    """
+    return routes_from_config(st.secrets["gemini"])
+
+def send_prompt_to_gemini(prompt, stream=False, media=None, prefix=None, trace=None, route=None):
+    """
+    Envía el prompt a Gemini con el pool de keys del proceso y retorna el
+    texto completo de la respuesta (ver `gemini_client.generate`).
+
+    Con `stream=True` los fragmentos se muestran en la página a medida que
+    llegan. Si el stream falla a mitad de camino se borra el texto parcial
+    y se vuelve a generar la respuesta completa con otra key del pool.
+    """
+    placeholder = st.empty() if stream else None
+    texto = generate(
+        prompt,
+        get_key_pool(),
+        context_cache=get_context_cache(),
+        media=media,
+        prefix=prefix,
+        trace=trace,
+        render_stream=placeholder.write_stream if stream else None,
+        on_retry=placeholder.empty if stream else None,
+        route=route,
     )
+    if placeholder is not None and texto in RESPUESTAS_FALLIDAS:
+        placeholder.write(texto)
+    return texto
+
+@st.cache_resource
+def get_prompt_builder():
+    """
+    Constructor de prompts del proceso; mide en segundo plano los tokens de
+    la parte fija de cada plantilla.
+    """
+    builder = PromptBuilder()
+    key_pool = get_key_pool()
+    builder.start_measuring(lambda texto: count_tokens(key_pool, texto))
+    return builder
+
+# La medición empieza al cargar la app, no en la primera evaluación
+get_prompt_builder()
+
+@st.cache_resource
+def get_response_cache():
+    """
+    Caché de respuestas por cuestionario (LRU en memoria y SQLite local).
+    La ruta de la base se puede cambiar en st.secrets["cache"]["path"].
+    """
+    return ResponseCache(path=st.secrets.get("cache", {}).get("path", DEFAULT_CACHE_PATH))
 
-model = create_model()
+# ============ Funciones para subir el video a Gemini ============
+def upload_to_gemini(path, lease, mime_type=None):
+    """
+    Sube el archivo dado a Gemini con la key prestada y retorna el objeto de archivo.
+    """
+    import google.generativeai as genai
 
-def switch_api_key():
-    global current_api_key_index, model
-    current_api_key_index = (current_api_key_index + 1) % len(api_keys)
-    configure_api()
-    model = create_model()
+    return genai.types.File(lease.file_client().create_file(
+        path, mime_type=mime_type, display_name=os.path.basename(path)
+    ))
 
-def send_prompt_to_gemini(prompt):
+def _upload_and_activate(
+    key_pool, upload_cache, video_spool, preprocess_pool, mode, cache_key, path, mime_type, trace
+):
+    """
+    Pre-procesa el video si corresponde, lo sube y espera a que quede activo.
+    Corre en un hilo de fondo, por lo que no usa funciones de Streamlit. Los
+    archivos temporales se borran apenas termina la subida, haya funcionado
+    o no. Los tiempos de cada etapa quedan en `trace` y en la entrada de la
+    caché.
+    """
+    import google.generativeai as genai
+
+    archivos = [path]
     try:
-        response = model.generate_content([prompt])
-        return response.text.strip() if response and response.text else "Sin respuesta."
-    except Exception as e:
-        switch_api_key()
-        try:
-            response = model.generate_content([prompt])
-            return response.text.strip() if response and response.text else "Sin respuesta."
-        except Exception as e:
-            return "Error al procesar la solicitud."
+        if mode != MODE_OFF:
+            try:
+                with metrics.span("preprocess", trace):
+                    path, mime_type = preprocess_pool.submit(
+                        preprocess_video, path, video_spool.directory, mode
+                    ).result()
+                video_spool.adopt(path)
+                archivos.append(path)
+            except (PreprocessError, BrokenProcessPool):
+                # Si el pre-procesamiento falla se sube el video original
+                pass
+        with key_pool.lease() as lease, metrics.span("upload", trace):
+            uploaded_video = upload_to_gemini(path, lease, mime_type=mime_type)
+    finally:
+        for archivo in archivos:
+            video_spool.release(archivo)
+    # Los archivos pertenecen al proyecto de la key que los sube, así que se
+    # consulta su estado con esa misma key
+    file_client = lease.file_client()
+    with metrics.span("activation", trace):
+        uploaded_video, = wait_for_files_active(
+            lambda name: genai.types.File(file_client.get_file(name=name)),
+            [uploaded_video],
+        )
+    return upload_cache.put(
+        cache_key, uploaded_video, mime_type, key_alias=lease.alias, timings=trace.timings
+    )
 
-# ============ Funciones para subir el video a Gemini ============
-def upload_to_gemini(path, mime_type=None):
+@st.cache_resource
+def get_preprocess_pool():
+    """
+    Procesos de trabajo para transcodificar videos sin ocupar el hilo de
+    Streamlit. Se usa "spawn" porque el proceso principal tiene varios hilos.
+    """
+    return ProcessPoolExecutor(max_workers=2, mp_context=multiprocessing.get_context("spawn"))
+
+def get_triage_policy():
+    """
+    Política para omitir el análisis de Gemini en casos de rutina, de
+    st.secrets["triage"]["skip_llm"]: "never" (por defecto), "routine" u
+    "overload" (solo cuando todas las keys están ocupadas).
+    """
+    return st.secrets.get("triage", {}).get("skip_llm", SKIP_NEVER)
+
+def get_preprocess_mode():
     """
-    Sube el archivo dado a Gemini y retorna el objeto de archivo.
+    Modo de pre-procesamiento configurado en st.secrets["video"]["preprocess"]
+    ("proxy", "keyframes" u "off", por defecto); sin ffmpeg instalado siempre
+    es "off".
     """
-    file = genai.upload_file(path, mime_type=mime_type)
-    st.write(f"Archivo '{file.display_name}' subido a: {file.uri}")
-    return file
+    mode = st.secrets.get("video", {}).get("preprocess", MODE_OFF)
+    return mode if ffmpeg_available() else MODE_OFF
 
-def wait_for_files_active(files):
+@st.cache_resource
+def get_upload_cache():
     """
-    Espera a que los archivos subidos estén activos.
-    Utiliza un spinner de Streamlit para mostrar el progreso.
+    Caché de videos ya subidos, compartida por todas las sesiones del proceso.
     """
-    with st.spinner("Esperando a que el archivo se procese..."):
-        for i, file in enumerate(files):
-            while file.state.name == "PROCESSING":
-                time.sleep(10)
-                file = genai.get_file(file.name)
-            if file.state.name != "ACTIVE":
-                raise Exception(f"El archivo {file.name} falló al procesarse")
-    st.success("El archivo ya está activo.")
+    return UploadCache()
+
+@st.cache_resource
+def get_video_spool():
+    """
+    Directorio de archivos temporales de video, con tope de espacio en disco.
+    """
+    return VideoSpool()
+
+@st.cache_resource
+def get_background_uploads():
+    """
+    Hilos de fondo para subir videos sin bloquear el formulario.
+    """
+    return BackgroundUploads()
+
+def _video_session_key(video_file):
+    return getattr(video_file, "file_id", None) or f"{video_file.name}:{video_file.size}"
+
+def start_video_upload(video_file, retry_failed=False):
+    """
+    Inicia en segundo plano la subida del video, salvo que ese contenido ya
+    se haya subido en esta sesión o en otra sesión del proceso. La sesión
+    guarda la entrada de la caché o el `Future` de la subida en curso.
+
+    Una subida que falló queda registrada en la sesión y solo se reintenta
+    con `retry_failed` (al presionar Evaluar): cada rerun del formulario
+    volvería a leer y subir el video completo, aunque la falla sea permanente.
+    Retorna el error de esa subida fallida, o None.
+    """
+    videos_sesion = st.session_state.setdefault("videos_subidos", {})
+    clave_sesion = _video_session_key(video_file)
+    trabajo = videos_sesion.get(clave_sesion)
+    if isinstance(trabajo, Future):
+        if not trabajo.done() or trabajo.exception() is None:
+            return None
+        if not retry_failed:
+            return trabajo.exception()
+    elif trabajo is not None and not trabajo.expired():
+        return None
+
+    # Los límites se revisan antes de escribir a disco o subir nada
+    mime_type, suffix = inspect_video(video_file, video_file.size)
+    upload_cache = get_upload_cache()
+    background_uploads = get_background_uploads()
+    mode = get_preprocess_mode()
+    # El mismo clip pre-procesado de otra forma es otro archivo en Gemini
+    cache_key = f"{hash_video_bytes(video_file)}:{mode}"
+    trabajo = upload_cache.get(cache_key) or background_uploads.get(cache_key)
+    metrics.inc(
+        "petscan_cache_requests_total", help="Consultas a las cachés por resultado.",
+        cache="upload", result="miss" if trabajo is None else "hit",
+    )
+    if trabajo is None:
+        # Copiar el video por bloques a un archivo temporal del spool
+        video_spool = get_video_spool()
+        subida = metrics.RequestTrace()
+        with metrics.span("video_write", subida):
+            temp_file_path = video_spool.write(video_file, video_file.size, suffix)
+        trabajo, creado = background_uploads.submit(
+            cache_key, _upload_and_activate,
+            get_key_pool(), upload_cache, video_spool, get_preprocess_pool(), mode,
+            cache_key, temp_file_path, mime_type, subida,
+        )
+        if not creado:
+            video_spool.release(temp_file_path)
+    videos_sesion[clave_sesion] = trabajo
+    return None
+
+def resolve_video(video_file, trace=None):
+    """
+    Retorna la entrada de la caché con la uri del video ya activo, esperando
+    a que termine la subida en curso si todavía no está lista. Si esta
+    evaluación esperó la subida, sus etapas se suman a `trace`; un video que
+    ya estaba listo no agrega tiempos.
+    """
+    start_video_upload(video_file, retry_failed=True)
+    videos_sesion = st.session_state["videos_subidos"]
+    clave_sesion = _video_session_key(video_file)
+    trabajo = videos_sesion[clave_sesion]
+    if isinstance(trabajo, Future):
+        trabajo = trabajo.result(timeout=DEADLINE_SECONDS + FFMPEG_TIMEOUT_SECONDS)
+        videos_sesion[clave_sesion] = trabajo
+        if trace is not None:
+            for etapa, segundos in trabajo.timings.items():
+                trace.record(etapa, segundos)
+    return trabajo
 
 # ============ Función para guardar la respuesta en Supabase ============
 def save_response_to_supabase(data):
-    response = supabase.table("responses").insert(data).execute()
-    return response
+    """
+    Encola la consulta para guardarla en Supabase sin esperar la respuesta
+    de la base de datos.
+    """
+    get_supabase_writer().submit(data)
 
 # =================== Inicio de la aplicación Streamlit ===================
 # Mostrar logo
-st.logo("Logo.png")
-st.image("Logo.png", caption="PetScan", width=200)
+st.logo(load_image("Logo.png", 400))
+st.image(load_image("Logo.png", 400), caption="PetScan", width=200)
 
 
-# Selección del idioma al inicio
-language = st.radio("Select Language / Seleccione el idioma:", options=["Español", "English"])
-
-if language == "English":
-    st.title("Preventive pet health assessment")
-    st.markdown(
-        """
-        **Welcome!**  
-        This application uses artificial intelligence to provide an initial evaluation of your pet's health.  
-
-        **How to use this application:**  
-        1. **Select your language.**  
-        2. **Enter your owner information:** Country, Owner's Name, Contact Number (with country code), and Email.  
-        3. **Provide general information** about your pet, including its type, eating habits, elimination, age, and grooming.  
-        4. **Answer additional questions** specific to your pet type (Cat or Dog).  
-        5. **Indicate if your pet has experienced diarrhea or vomiting.**  
-           - If yes, a warning will appear urging you to consult a veterinarian immediately.  
-        6. **Optionally, upload a video** of your pet.  
-        7. Click the **Evaluate** button to receive a detailed, empathetic analysis with clear recommendations.
-
-        **Note:** This is an initial assessment provided by an AI, which may not be entirely accurate. If in doubt, please consult a veterinarian.
-        """
-    )
-    
-    # Información del Dueño
-    st.subheader("Owner Information")
-    owner_country = st.text_input("Country")
-    owner_name = st.text_input("Owner's Name")
-    owner_contact = st.text_input("Contact Number (with country code)")
-    owner_email = st.text_input("Email")
-    
-    # Preguntas sobre el animal
-    tipo_animal = st.radio("What type of animal is it?", options=["Cat", "Dog"])
-    
-    # Preguntas generales
-    comida = st.radio("Is the animal eating and drinking?", options=["Yes", "No"])
-    eliminacion = st.radio("Is it eliminating normally?", options=["Yes", "No"])
-    edad = st.number_input("How old is the animal?", min_value=0, max_value=50, value=3)
-    acicala = st.radio("Is it grooming itself properly?", options=["Yes", "No"])
-    
-    # Pregunta sobre diarrea o vómito
-    diarrhea_vomiting = st.radio("Has the animal experienced diarrhea or vomiting?", options=["Yes", "No"])
-    if diarrhea_vomiting == "Yes":
-        st.warning("Warning: It is highly recommended to consult a veterinarian immediately.")
-    
-    # Preguntas específicas según el tipo de animal
-    if tipo_animal == "Cat":
-        st.subheader("Additional Questions for Cats")
-        grooming_regular = st.radio("Does the cat groom itself regularly?", options=["Yes", "No"])
-        cambios_grooming = st.radio("Have there been any changes in its grooming habits?", options=["Yes", "No"])
-        comportamiento_cambio = st.radio("Has the cat's behavior changed recently?", options=["Yes", "No"])
-        sociable = st.radio("Is the cat sociable or shy?", options=["Sociable", "Shy"])
-        ocultarse = st.radio("Does the cat hide or avoid interaction?", options=["Yes", "No"])
-        reacio = st.radio("Does the cat seem reluctant to go out even to see its favorite person or get its food?", options=["Yes", "No"])
-        
-        st.write("Which of these images most closely resembles your cat's overall condition recently?")
-        col1, col2 = st.columns(2)
-        with col1:
-            st.image("gato_normal.png", caption="Normal condition (Ears up, mouth closed, eyes open, relaxed whiskers)")
-        with col2:
-            st.image("gato_dolor.png", caption="Condition with pain (Eyes closed, ears down, mouth open, bristled whiskers)")
-        
-        imagen_estado_gato = st.radio(
-            "Select the image that best represents your cat's condition:",
-            options=["Normal condition", "Condition with pain"]
-        )
-    else:
-        st.subheader("Additional Questions for Dogs")
-        aseo_regular = ""
-        cambios_aseo = st.radio("Is your dog scratching more than usual?", options=["Yes", "No"])
-        comportamiento_cambio = st.radio("Has the dog's behavior changed recently?", options=["Yes", "No"])
-        sociable = st.radio("Is the dog sociable or does it show shyness/aggressiveness?", options=["Sociable", "Shy/Aggressive"])
-        ocultarse = st.radio("Does the dog hide or avoid interaction?", options=["Yes", "No"])
-        reacio = st.radio("Does the dog seem reluctant to go out even to interact with its owner or receive food?", options=["Yes", "No"])
-    
-    video_file = st.file_uploader("Upload a video of the pet (optional)", type=["mp4", "mov", "avi"])
-
-else:
-    st.title("Evaluación Inicial de Salud de Mascotas")
-    st.markdown(
-        """
-        **¡Bienvenido!**  
-        Esta aplicación utiliza inteligencia artificial para ofrecer una evaluación inicial de la salud de su mascota.  
-
-        **Cómo usar esta aplicación:**  
-        1. **Seleccione el idioma.**  
-        2. **Ingrese la información del dueño:** País, Nombre del dueño, Número de contacto (con indicativo del país) y Email.  
-        3. **Proporcione información general** sobre su mascota, incluyendo tipo, hábitos alimenticios, eliminación, edad y acicalamiento.  
-        4. **Responda las preguntas adicionales** específicas según el tipo de animal (Gato o Perro).  
-        5. **Indique si el animal ha tenido diarrea o vómito.**  
-           - Si responde que sí, se mostrará una advertencia para que consulte a un veterinario de inmediato.  
-        6. **Opcionalmente, suba un video** de su mascota.  
-        7. Presione el botón **Evaluar** para recibir un análisis detallado y empático del estado de su mascota con recomendaciones claras.
-
-        **Nota:** Esta es una evaluación inicial proporcionada por una IA, la cual puede no ser completamente precisa. Ante cualquier duda, consulte a un veterinario.
-        """
-    )
-    
-    # Información del Dueño
-    st.subheader("Información del Dueño")
-    owner_country = st.text_input("País")
-    owner_name = st.text_input("Nombre del dueño")
-    owner_contact = st.text_input("Número de contacto (con indicativo del país)")
-    owner_email = st.text_input("Email")
-    
-    # Preguntas sobre el animal
-    tipo_animal = st.radio("¿Qué tipo de animal es?", options=["Gato", "Perro"])
-    
-    # Preguntas generales
-    comida = st.radio("¿Está comiendo y tomando agua?", options=["Sí", "No"])
-    eliminacion = st.radio("¿Está orinando y defecando normalmente?", options=["Sí", "No"])
-    edad = st.number_input("¿Qué edad tiene el animal?", min_value=0, max_value=50, value=3)
-    acicala = st.radio("¿Se acicala correctamente?", options=["Sí", "No"])
-    
-    # Pregunta sobre diarrea o vómito
-    diarrhea_vomiting = st.radio("¿El animal ha tenido diarrea o vómito?", options=["Sí", "No"])
-    if diarrhea_vomiting == "Sí":
-        st.warning("Advertencia: Es altamente recomendable consultar a un veterinario inmediatamente.")
-    
-    # Preguntas específicas según el tipo de animal
-    if tipo_animal == "Gato":
-        st.subheader("Preguntas adicionales para gatos")
-        grooming_regular = st.radio("¿El gato se acicala regularmente?", options=["Sí", "No"])
-        cambios_grooming = st.radio("¿Ha habido algún cambio en sus hábitos de acicalamiento?", options=["Sí", "No"])
-        comportamiento_cambio = st.radio("¿Ha cambiado recientemente el comportamiento del gato?", options=["Sí", "No"])
-        sociable = st.radio("¿El gato es sociable o tímido?", options=["Sociable", "Tímido"])
-        ocultarse = st.radio("¿El gato se esconde o evita interactuar?", options=["Sí", "No"])
-        reacio = st.radio("¿El gato se muestra reacio a salir incluso para ver a su persona favorita o recibir su comida?", options=["Sí", "No"])
-        
-        st.write("¿Cuál de estas imágenes se parece más al estado general de su gato en el último tiempo?")
-        col1, col2 = st.columns(2)
-        with col1:
-            st.image("gato_normal.png", caption="Estado normal (Orejas arriba, boca cerrada, ojos abiertos, Bigotes relajados)")
-        with col2:
-            st.image("gato_dolor.png", caption="Estado con dolor (Ojos cerrados, orejas caídas, boca abierta, Bigotes erizados)")
-        
-        imagen_estado_gato = st.radio(
-            "Seleccione la imagen que más se parezca al estado de su gato:",
-            options=["Estado normal", "Estado con dolor"]
+def render_question(question, lang):
+    """
+    Muestra el widget de una pregunta del esquema y retorna la respuesta.
+    """
+    if question.intro:
+        st.write(question.intro[lang])
+    if question.images:
+        columnas = st.columns(len(question.images))
+        for columna, (ruta, pie) in zip(columnas, question.images):
+            with columna:
+                st.image(load_image(ruta, 500), caption=pie[lang])
+
+    if question.widget == "text":
+        valor = st.text_input(question.label[lang])
+    elif question.widget == "number":
+        valor = st.number_input(
+            question.label[lang],
+            min_value=question.min_value,
+            max_value=question.max_value,
+            value=question.default,
         )
     else:
-        st.subheader("Preguntas adicionales para perros")
-        aseo_regular = ""
-        cambios_aseo = st.radio("¿Se rasca más de lo común?", options=["Sí", "No"])
-        comportamiento_cambio = st.radio("¿Ha cambiado recientemente el comportamiento del perro?", options=["Sí", "No"])
-        sociable = st.radio("¿El perro es sociable o muestra timidez/agresividad?", options=["Sí", "No"])
-        ocultarse = st.radio("¿El perro se esconde o evita interactuar?", options=["Sí", "No"])
-        reacio = st.radio("¿El perro se muestra reacio a salir incluso para interactuar con su dueño o recibir su comida?", options=["Sí", "No"])
-    
-    video_file = st.file_uploader("Sube un video del animal (opcional)", type=["mp4", "mov", "avi"])
+        valor = st.radio(question.label[lang], options=question.option_labels(lang))
+
+    if question.warn_on is not None and valor == question.options[question.warn_on][lang]:
+        st.warning(question.warning[lang])
+    return valor
+
+def render_triage(resultado, lang):
+    """
+    Muestra el nivel de urgencia del triaje con su indicación estándar.
+    """
+    mostrar = {LEVEL_URGENT: st.error, LEVEL_SOON: st.warning, LEVEL_ROUTINE: st.success}[resultado.level]
+    st.subheader(text("triage_header", lang))
+    mostrar(f"**{resultado.label(lang)}**\n\n{resultado.guidance(lang)}")
+    if resultado.reasons:
+        st.caption(f"{text('triage_reasons', lang)}: {', '.join(resultado.reason_texts(lang))}")
+
+# Selección del idioma al inicio
+language = st.radio("Select Language / Seleccione el idioma:", options=list(LANGUAGES))
+lang = LANGUAGES[language]
 
-video_uri = None
+st.title(text("title", lang))
+st.markdown(text("intro", lang))
+
+# Información del Dueño
+st.subheader(text("owner_header", lang))
+duenio = {q.field: render_question(q, lang) for q in OWNER_QUESTIONS}
+
+# Preguntas sobre el animal; las respuestas usan los nombres de columna de Supabase
+respuestas = {SPECIES_QUESTION.field: render_question(SPECIES_QUESTION, lang)}
+for question in (*GENERAL_QUESTIONS, DIARRHEA_QUESTION):
+    respuestas[question.field] = render_question(question, lang)
+
+# Preguntas específicas según el tipo de animal
+especie = species_code(respuestas["tipo_animal"])
+st.subheader(TEXTS["species_header"][especie][lang])
+for question in species_questions(especie):
+    respuestas[question.field] = render_question(question, lang)
+
+video_file = st.file_uploader(text("video", lang), type=["mp4", "mov", "avi"])
+
+# La subida y el procesamiento del video siguen en segundo plano mientras se
+# completa el formulario; la uri se recoge al presionar Evaluar
 if video_file is not None:
-    # Guardar el archivo subido en un archivo temporal
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
-        temp_file.write(video_file.getvalue())
-        temp_file_path = temp_file.name
-    st.write(f"Video guardado temporalmente en: {temp_file_path}")
-    
-    # Subir el video a Gemini y esperar a que esté activo
     try:
-        uploaded_video = upload_to_gemini(temp_file_path, mime_type="video/mp4")
-        wait_for_files_active([uploaded_video])
-        video_uri = uploaded_video.uri
+        error_subida = start_video_upload(video_file)
+        if error_subida is not None:
+            st.warning(text("video_failed", lang).format(error=error_subida))
+    except VideoRejected as e:
+        st.error(str(e))
     except Exception as e:
-        st.error(f"Error al subir o procesar el video: {e}")
+        st.error(text("video_error", lang).format(error=e))
 
 # Botón para evaluar / Evaluate button
-button_text = "Evaluate" if language == "English" else "Evaluar"
-if st.button(button_text):
-    if language == "English":
-        prompt = f"Pet Health Evaluation for a {tipo_animal}.\n"
-        prompt += f"- Eating and drinking: {comida}\n"
-        prompt += f"- Normal elimination: {eliminacion}\n"
-        prompt += f"- Age: {edad}\n"
-        prompt += f"- Grooming: {acicala}\n\n"
-        prompt += "Owner Information:\n"
-        prompt += f"- Country: {owner_country}\n"
-        prompt += f"- Owner's Name: {owner_name}\n"
-        prompt += f"- Contact Number: {owner_contact}\n"
-        prompt += f"- Email: {owner_email}\n\n"
-        
-        if tipo_animal == "Cat":
-            prompt += "Additional questions for cats:\n"
-            prompt += f"- Regular grooming: {grooming_regular}\n"
-            prompt += f"- Changes in grooming: {cambios_grooming}\n"
-            prompt += f"- Change in behavior: {comportamiento_cambio}\n"
-            prompt += f"- Sociability: {sociable}\n"
-            prompt += f"- Hiding: {ocultarse}\n"
-            prompt += f"- Reluctance to go out: {reacio}\n"
-            prompt += f"- Image representing overall condition: {imagen_estado_gato}\n\n"
-        else:
-            prompt += "Additional questions for dogs:\n"
-            prompt += f"- Regular cleaning/licking: {aseo_regular}\n"
-            prompt += f"- Changes in grooming habits: {cambios_aseo}\n"
-            prompt += f"- Change in behavior: {comportamiento_cambio}\n"
-            prompt += f"- Sociability: {sociable}\n"
-            prompt += f"- Hiding: {ocultarse}\n"
-            prompt += f"- Reluctance to go out: {reacio}\n\n"
-        
-        prompt += f"- Diarrhea or vomiting: {diarrhea_vomiting}\n\n"
-        
-        prompt += "Evaluation criteria:\n"
-        prompt += "Eyes: Are the eyes half-closed or narrowed? Is there any wrinkling around the eyes?\n"
-        prompt += "Nose and Cheeks: Is the bridge of the nose flattened or elongated? Are the cheeks flattened or appear sunken?\n"
-        prompt += "Ears: Are the ears turned inward and forward, creating a pointed shape? Has the space between the ears increased?\n"
-        prompt += "Whiskers: Are the whiskers stiff and held close to the face? Are the whiskers clumped together? Have the whiskers lost their natural downward curve?\n"
-        prompt += "Additional Considerations: Pain Assessment using a validated scale (e.g., Feline Grimace Scale for cats) and species-specific features.\n\n"
-        
-        if video_uri:
-            prompt += f"Uploaded video: {video_uri}\n\n"
-        
-        prompt += ("Please analyze all the provided information accurately, but respond in a kind and approachable manner. "
-                   "Explain what is observed and provide clear recommendations on actions to take, using an empathetic and understanding tone. "
-                   "The response should be detailed and deep, without losing precision in the analysis.\n")
-        
-        prompt += "\n**Note:** This information is analyzed by an AI, which may be incorrect. In case of any doubt, please consult a veterinarian."
-    else:
-        prompt = f"Evaluación de salud para un {tipo_animal}.\n"
-        prompt += f"- Comiendo y bebiendo: {comida}\n"
-        prompt += f"- Eliminación normal: {eliminacion}\n"
-        prompt += f"- Edad: {edad}\n"
-        prompt += f"- Acicalamiento: {acicala}\n\n"
-        prompt += "Información del Dueño:\n"
-        prompt += f"- País: {owner_country}\n"
-        prompt += f"- Nombre del dueño: {owner_name}\n"
-        prompt += f"- Número de contacto: {owner_contact}\n"
-        prompt += f"- Email: {owner_email}\n\n"
-        
-        if tipo_animal == "Gato":
-            prompt += "Preguntas específicas para gatos:\n"
-            prompt += f"- Se acicala regularmente: {grooming_regular}\n"
-            prompt += f"- Cambios en el acicalamiento: {cambios_grooming}\n"
-            prompt += f"- Cambio en comportamiento: {comportamiento_cambio}\n"
-            prompt += f"- Sociabilidad: {sociable}\n"
-            prompt += f"- Se esconde: {ocultarse}\n"
-            prompt += f"- Reacio a salir: {reacio}\n"
-            prompt += f"- Imagen que representa el estado general: {imagen_estado_gato}\n\n"
-        else:
-            prompt += "Preguntas específicas para perros:\n"
-            prompt += f"- Se limpia o lame regularmente: {aseo_regular}\n"
-            prompt += f"- Cambios en hábitos de aseo: {cambios_aseo}\n"
-            prompt += f"- Cambio en comportamiento: {comportamiento_cambio}\n"
-            prompt += f"- Sociabilidad: {sociable}\n"
-            prompt += f"- Se esconde: {ocultarse}\n"
-            prompt += f"- Reacio a salir: {reacio}\n\n"
-        
-        prompt += f"- Diarrea o vómito: {diarrhea_vomiting}\n\n"
-        
-        prompt += "Criterios para evaluar la información:\n"
-        prompt += "Eyes: ¿Los ojos están entrecerrados o se ven estrechos? ¿Hay algún fruncimiento alrededor de los ojos?\n"
-        prompt += "Nose and Cheeks: ¿El puente de la nariz está aplanado o alargado? ¿Las mejillas están aplanadas o se ven hundidas?\n"
-        prompt += "Ears: ¿Las orejas están giradas hacia adentro y hacia adelante, creando una forma puntiaguda? ¿Ha aumentado el espacio entre las orejas?\n"
-        prompt += "Whiskers: ¿Los bigotes están rígidos y pegados a la cara? ¿Los bigotes se ven aglomerados? ¿Han perdido los bigotes su curva natural hacia abajo?\n"
-        prompt += "Consideraciones adicionales: Evaluación del dolor usando una escala validada (por ejemplo, Feline Grimace Scale para gatos) y características específicas de la especie.\n\n"
-        
-        if video_uri:
-            prompt += f"Video cargado: {video_uri}\n\n"
-        
-        prompt += ("Por favor, analiza toda la información proporcionada de forma precisa, pero respondiendo de manera amable y cercana. "
-                   "Explique lo que se observa y brinde recomendaciones claras sobre qué acciones tomar, en un tono empático y comprensivo. "
-                   "La respuesta debe ser detallada y profunda, sin perder la precisión en el análisis.\n")
-        
-        prompt += "\n**Nota:** Esta información es analizada por una IA, la cual puede equivocarse. Ante cualquier duda, consulte a un veterinario."
-    
-    st.write("El siguiente prompt se enviará a Gemini:")
-    st.code(prompt)
-    
-    # Enviar el prompt a Gemini y obtener la respuesta
-    respuesta = send_prompt_to_gemini(prompt)
-    if language == "English":
-        st.subheader("AI Response:")
-    else:
-        st.subheader("Respuesta de la IA:")
-    st.write(respuesta)
+if st.button(text("button", lang)):
+    trace = metrics.RequestTrace()
+    # El triaje por reglas no depende de Gemini: se muestra antes de esperar
+    # el video o la respuesta, que se completa debajo cuando llega
+    with trace.span("triage"):
+        resultado_triaje = triage(respuestas)
+    render_triage(resultado_triaje, lang)
+
+    video_uri = None
+    video_media = None
+    if video_file is not None:
+        try:
+            with st.spinner(text("video_processing", lang)), trace.span("video_wait"):
+                video_media = resolve_video(video_file, trace)
+                video_uri = video_media.uri
+            st.success(text("video_active", lang))
+        except Exception as e:
+            st.error(text("video_error", lang).format(error=e))
+
+    omitir_ia = should_skip_llm(
+        resultado_triaje, get_triage_policy(),
+        has_video=video_media is not None, overloaded=get_key_pool().saturated(),
+    )
+    # Los datos del dueño no se envían a Gemini: no aportan a la evaluación y
+    # así una respuesta en caché nunca contiene datos de otra persona
+    with trace.span("prompt_build"):
+        prompt = get_prompt_builder().build(lang, respuestas, video_uri)
+
+    st.subheader(text("response_header", lang))
+    # Los cuestionarios sin video con las mismas respuestas reutilizan la
+    # respuesta ya generada
+    ruta = choose_route(get_routes(), video_media)
+    cache_key = None
+    respuesta = None
+    if omitir_ia:
+        st.write(text("llm_skipped", lang))
+        metrics.inc("petscan_llm_skipped_total", help="Análisis de Gemini omitidos por el triaje.")
+    elif video_media is None:
+        cache_key = response_cache_key(respuestas, language, ruta.model, PROMPT_VERSION)
+        with trace.span("response_cache"):
+            respuesta = get_response_cache().get(cache_key)
+        metrics.inc(
+            "petscan_cache_requests_total", help="Consultas a las cachés por resultado.",
+            cache="response", result="miss" if respuesta is None else "hit",
+        )
+    if respuesta is not None:
+        st.write(respuesta)
+    elif not omitir_ia:
+        respuesta = send_prompt_to_gemini(
+            prompt, stream=True, media=video_media,
+            prefix=get_prompt_builder().static_prefix(lang, respuestas),
+            trace=trace, route=ruta,
+        )
+        if cache_key is not None and respuesta not in RESPUESTAS_FALLIDAS:
+            get_response_cache().put(cache_key, respuesta)
     
     # Recopilar los datos para guardar en la base de datos Supabase
-    data = {
-        "timestamp": datetime.now().isoformat(),
-        "language": language,
-        "owner_country": owner_country,
-        "owner_name": owner_name,
-        "owner_contact": owner_contact,
-        "owner_email": owner_email,
-        "tipo_animal": tipo_animal,
-        "comida": comida,
-        "eliminacion": eliminacion,
-        "edad": edad,
-        "acicala": acicala,
-        "diarrhea_vomiting": diarrhea_vomiting,
-        "video_uri": video_uri if video_uri is not None else "",
-        "prompt": prompt,
-        "ai_response": respuesta
-    }
-    # Agregar campos adicionales según el tipo de animal
-    if tipo_animal in ["Cat", "Gato"]:
-        data["grooming_regular"] = grooming_regular
-        data["cambios_grooming"] = cambios_grooming
-        data["comportamiento_cambio"] = comportamiento_cambio
-        data["sociable"] = sociable
-        data["ocultarse"] = ocultarse
-        data["reacio"] = reacio
-        data["imagen_estado"] = imagen_estado_gato
-    else:
-        data["aseo_regular"] = aseo_regular
-        data["cambios_aseo"] = cambios_aseo
-        data["comportamiento_cambio"] = comportamiento_cambio
-        data["sociable"] = sociable
-        data["ocultarse"] = ocultarse
-        data["reacio"] = reacio
+    data = response_row(
+        language, duenio, respuestas, prompt, respuesta, resultado_triaje, trace, video_uri=video_uri
+    )
 
     # Guardar los datos en Supabase en lugar de un CSV
-    response = save_response_to_supabase(data)
-    st.write("Consulta guardada en la base de datos Supabase:", response)
+    try:
+        with metrics.span("save_enqueue"):
+            save_response_to_supabase(data)
+        st.write(text("saved", lang))
+    except WriterOverloaded:
+        st.error(text("save_failed", lang))
 
@@ -0,0 +1,362 @@
+"""
+Evaluación por lotes de cuestionarios exportados, sin la interfaz.
+
+Las clínicas envían exportaciones CSV o JSONL con las mismas columnas que la
+tabla responses (tipo_animal, edad, ..., y opcionalmente language y los
+datos del dueño). Cada registro se evalúa con el mismo prompt y el mismo
+ciclo de envío que la app (gemini_client.generate) y el resultado se guarda
+en Supabase a través de la cola del SupabaseWriter, que inserta por lotes.
+
+El archivo se lee en streaming y un pool de hilos acotado procesa los
+registros; cada hilo pide una key al pool, que respeta el límite por minuto
+de cada una, así que el throughput crece con la cantidad de keys en
+[gemini]. El progreso queda en un checkpoint SQLite: al volver a correr el
+mismo archivo se saltan los registros ya guardados y los que fallaron por
+cuota o red se reintentan.
+
+Uso:
+
+    python batch.py cuestionarios.csv
+    python batch.py cuestionarios.jsonl --workers 12 --checkpoint lote.sqlite3
+"""
+import argparse
+import csv
+import functools
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import tomllib
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
+
+import metrics
+from gemini_client import (
+    FAILED_RESPONSES,
+    PROMPT_VERSION,
+    ROUTE_TEXT,
+    context_cache_from_config,
+    count_tokens,
+    generate,
+    key_pool_from_config,
+    routes_from_config,
+)
+from questionnaire import (
+    DIARRHEA_QUESTION,
+    GENERAL_QUESTIONS,
+    LANGUAGES,
+    OWNER_QUESTIONS,
+    SPECIES_QUESTION,
+    PromptBuilder,
+    species_code,
+    species_questions,
+)
+from response_cache import DEFAULT_PATH as DEFAULT_CACHE_PATH, ResponseCache, response_cache_key
+from supabase_writer import WriterOverloaded, response_row, supabase_writer_from_config
+from triage import SKIP_NEVER, should_skip_llm, triage
+
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+# Cola propia: la de la app la vacía el proceso de Streamlit
+DEFAULT_QUEUE_PATH = os.path.join(tempfile.gettempdir(), "petscan-batch-queue.sqlite3")
+# Hilos por key cuando no se indica --workers
+WORKERS_PER_KEY = 2
+# Un lote espera su turno en el pool en lugar de fallar como una sesión interactiva
+ACQUIRE_TIMEOUT_SECONDS = 10 * 60
+
+STATUS_DONE = "done"
+STATUS_INVALID = "invalid"
+
+
+class InvalidRecord(Exception):
+    """El registro no tiene las respuestas que necesita el prompt."""
+
+
+class Checkpoint:
+    """
+    Registros ya resueltos de un archivo: guardados en la cola de Supabase
+    (`done`) o rechazados por datos inválidos (`invalid`). Los que fallaron
+    en Gemini no se anotan, para reintentarlos en la próxima corrida.
+    """
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS records ("
+            " record_id TEXT PRIMARY KEY, status TEXT NOT NULL,"
+            " error TEXT NOT NULL DEFAULT '', finished REAL NOT NULL)"
+        )
+
+    def resolved(self):
+        with self._lock:
+            return {fila[0] for fila in self._db.execute("SELECT record_id FROM records")}
+
+    def mark(self, record_id, status, error=""):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO records (record_id, status, error, finished) VALUES (?, ?, ?, ?)",
+                (record_id, status, error, time.time()),
+            )
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+def read_records(path):
+    """
+    Entrega `(record_id, registro)` sin cargar el archivo completo. El id es
+    la columna `id` si existe o el número de registro dentro del archivo.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as archivo:
+        if path.lower().endswith((".jsonl", ".ndjson")):
+            registros = (json.loads(linea) for linea in archivo if linea.strip())
+        else:
+            registros = csv.DictReader(archivo)
+        for numero, registro in enumerate(registros, start=1):
+            yield str(registro.get("id") or numero), registro
+
+
+def _language(valor):
+    if not valor:
+        return "Español"
+    for nombre, codigo in LANGUAGES.items():
+        if valor in (nombre, codigo):
+            return nombre
+    raise InvalidRecord(f"Idioma desconocido: {valor}")
+
+
+def _answer(question, registro, lang):
+    valor = registro.get(question.field)
+    if valor is None or valor == "":
+        raise InvalidRecord(f"Falta la respuesta {question.field}")
+    if question.widget == "number":
+        try:
+            return int(valor)
+        except (TypeError, ValueError):
+            raise InvalidRecord(f"{question.field} no es un número: {valor}") from None
+    if question.widget == "radio" and valor not in question.option_labels(lang):
+        raise InvalidRecord(f"Opción desconocida en {question.field}: {valor}")
+    return valor
+
+
+def record_answers(registro):
+    """
+    Retorna `(language, duenio, respuestas)` con los mismos campos que arma
+    el formulario, o lanza `InvalidRecord`.
+    """
+    language = _language(registro.get("language"))
+    lang = LANGUAGES[language]
+    try:
+        especie = species_code(registro.get("tipo_animal"))
+    except ValueError as e:
+        raise InvalidRecord(str(e)) from None
+    respuestas = {}
+    for question in (SPECIES_QUESTION, *GENERAL_QUESTIONS, DIARRHEA_QUESTION, *species_questions(especie)):
+        respuestas[question.field] = _answer(question, registro, lang)
+    duenio = {q.field: registro.get(q.field) or "" for q in OWNER_QUESTIONS}
+    return language, duenio, respuestas
+
+
+class BatchRunner:
+    def __init__(
+        self,
+        key_pool,
+        writer,
+        checkpoint,
+        response_cache=None,
+        context_cache=None,
+        workers=None,
+        triage_policy=SKIP_NEVER,
+        route=None,
+    ):
+        self.key_pool = key_pool
+        self.writer = writer
+        self.checkpoint = checkpoint
+        self.response_cache = response_cache
+        self.context_cache = context_cache
+        self.workers = workers or key_pool.size * WORKERS_PER_KEY
+        self.triage_policy = triage_policy
+        self.route = route or routes_from_config({})[ROUTE_TEXT]
+        self.prompt_builder = PromptBuilder()
+        self.prompt_builder.start_measuring(lambda texto: count_tokens(key_pool, texto))
+        # `done` incluye las respuestas tomadas de la caché (`cached`) y los
+        # casos de rutina guardados sin análisis de Gemini (`llm_skipped`)
+        self.done = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.failed = 0
+        self.cached = 0
+        self.llm_skipped = 0
+        self._lock = threading.Lock()
+
+    def run(self, records, progress=None):
+        resueltos = self.checkpoint.resolved()
+        # Acota los registros leídos y no procesados, para no cargar el archivo entero
+        en_vuelo = threading.BoundedSemaphore(self.workers * 2)
+
+        def terminado(record_id, futuro):
+            en_vuelo.release()
+            error = futuro.exception()
+            if error is not None:
+                # Sin checkpoint: el registro se reintenta en la próxima corrida
+                self._count("failed")
+                detalle = "".join(traceback.format_exception(error))
+                print(f"Registro {record_id} falló:\n{detalle}", file=sys.stderr, end="")
+
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="batch") as pool:
+            for record_id, registro in records:
+                if record_id in resueltos:
+                    self.skipped += 1
+                    continue
+                en_vuelo.acquire()
+                futuro = pool.submit(self._process, record_id, registro)
+                futuro.add_done_callback(functools.partial(terminado, record_id))
+                if progress is not None:
+                    progress(self)
+        return self.stats()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "done": self.done,
+                "cached": self.cached,
+                "llm_skipped": self.llm_skipped,
+                "skipped": self.skipped,
+                "invalid": self.invalid,
+                "failed": self.failed,
+            }
+
+    def _count(self, campo):
+        with self._lock:
+            setattr(self, campo, getattr(self, campo) + 1)
+
+    def _process(self, record_id, registro):
+        try:
+            language, duenio, respuestas = record_answers(registro)
+        except InvalidRecord as e:
+            self.checkpoint.mark(record_id, STATUS_INVALID, str(e))
+            self._count("invalid")
+            return
+        lang = LANGUAGES[language]
+        trace = metrics.RequestTrace()
+        resultado_triaje = triage(respuestas)
+        # Un lote agota la cuota de las keys a propósito, así que el pool casi
+        # siempre está saturado: con "overload" se omitiría a Gemini en casi
+        # todos los casos de rutina, y el checkpoint no los volvería a procesar
+        omitir_ia = should_skip_llm(resultado_triaje, self.triage_policy, overloaded=False)
+        try:
+            with trace.span("prompt_build"):
+                prompt = self.prompt_builder.build(lang, respuestas)
+        except ValueError as e:
+            self.checkpoint.mark(record_id, STATUS_INVALID, str(e))
+            self._count("invalid")
+            return
+        respuesta = None
+        cache_key = None
+        if omitir_ia:
+            self._count("llm_skipped")
+        elif self.response_cache is not None:
+            cache_key = response_cache_key(respuestas, language, self.route.model, PROMPT_VERSION)
+            with trace.span("response_cache"):
+                respuesta = self.response_cache.get(cache_key)
+        if respuesta is not None:
+            self._count("cached")
+        elif not omitir_ia:
+            respuesta = generate(
+                prompt,
+                self.key_pool,
+                context_cache=self.context_cache,
+                prefix=self.prompt_builder.static_prefix(lang, respuestas),
+                trace=trace,
+                route=self.route,
+            )
+            if respuesta in FAILED_RESPONSES:
+                # Sin checkpoint: se reintenta en la próxima corrida
+                self._count("failed")
+                return
+            if cache_key is not None:
+                self.response_cache.put(cache_key, respuesta)
+
+        data = response_row(language, duenio, respuestas, prompt, respuesta, resultado_triaje, trace)
+        while True:
+            try:
+                self.writer.submit(data)
+                break
+            except WriterOverloaded:
+                # Supabase no da abasto: se espera a que la cola baje
+                time.sleep(1.0)
+        self.checkpoint.mark(record_id, STATUS_DONE)
+        self._count("done")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Evalúa un archivo CSV o JSONL de cuestionarios.")
+    parser.add_argument("input", help="archivo .csv o .jsonl")
+    parser.add_argument("--checkpoint", help="por defecto, <input>.checkpoint.sqlite3")
+    parser.add_argument("--workers", type=int, help=f"hilos en paralelo (por defecto {WORKERS_PER_KEY} por key)")
+    parser.add_argument("--secrets", default=SECRETS_PATH)
+    parser.add_argument("--queue", default=DEFAULT_QUEUE_PATH, help="cola local de filas para Supabase")
+    parser.add_argument("--no-cache", action="store_true", help="no usar la caché de respuestas")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with open(args.secrets, "rb") as archivo:
+        secrets = tomllib.load(archivo)
+
+    key_pool = key_pool_from_config(secrets["gemini"])
+    key_pool.acquire_timeout = ACQUIRE_TIMEOUT_SECONDS
+    writer = supabase_writer_from_config(secrets["supabase"], args.queue)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.input}.checkpoint.sqlite3")
+    response_cache = None
+    if not args.no_cache:
+        response_cache = ResponseCache(path=secrets.get("cache", {}).get("path", DEFAULT_CACHE_PATH))
+    runner = BatchRunner(
+        key_pool,
+        writer,
+        checkpoint,
+        response_cache=response_cache,
+        context_cache=context_cache_from_config(secrets["gemini"]),
+        workers=args.workers,
+        triage_policy=secrets.get("triage", {}).get("skip_llm", SKIP_NEVER),
+        # En lotes importa el total, no la cola de latencia: duplicar
+        # solicitudes solo gastaría cuota
+        route=replace(routes_from_config(secrets["gemini"])[ROUTE_TEXT], hedge=False),
+    )
+
+    inicio = time.monotonic()
+    ultimo = [inicio]
+
+    def progress(runner):
+        ahora = time.monotonic()
+        if ahora - ultimo[0] >= 10:
+            ultimo[0] = ahora
+            stats = runner.stats()
+            ritmo = stats["done"] / (ahora - inicio)
+            print(f"{stats} ({ritmo * 60:.1f} registros/min)", file=sys.stderr)
+
+    try:
+        stats = runner.run(read_records(args.input), progress)
+    except KeyboardInterrupt:
+        # Al salir del pool los registros en curso ya terminaron y quedaron
+        # en el checkpoint; la próxima corrida sigue desde ahí
+        stats = runner.stats()
+    finally:
+        print("Esperando a que la cola de Supabase se vacíe...", file=sys.stderr)
+        writer.close(timeout=120)
+        checkpoint.close()
+
+    duracion = time.monotonic() - inicio
+    print(json.dumps({**stats, "seconds": round(duracion, 1), "pending_rows": writer.pending}))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,413 @@
+"""
+Servidor local que imita la parte de la API de Gemini que usa la app.
+
+Atiende la subida de archivos (upload resumable del documento de discovery),
+`files.get`, `generateContent`, `streamGenerateContent`, `countTokens` y
+`cachedContents`, con latencias configurables y errores 429 inyectados: al
+azar (`rate_limit_ratio`) o al pasar un límite de solicitudes por minuto por
+key (`requests_per_minute`), igual que la cuota del plan gratuito. Los
+archivos quedan en PROCESSING durante `processing_seconds` antes de pasar a
+ACTIVE.
+
+No guarda el contenido de los archivos; solo cuenta los bytes recibidos.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import defaultdict, deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+RESPONSE_TEXT = (
+    "Según las respuestas, su mascota muestra signos que conviene vigilar. "
+    "Mantenga agua fresca disponible, observe su apetito y su actividad durante "
+    "las próximas 24 horas y consulte con su veterinario si los síntomas persisten."
+)
+
+
+def _ttl_seconds(cuerpo):
+    """
+    Saca `ttl` ("3600s") del cuerpo: la respuesta solo puede traer uno de
+    `ttl` o `expireTime`, y el SDK rechaza las que traen ambos.
+    """
+    return float(str(cuerpo.pop("ttl", "3600s")).rstrip("s"))
+
+
+def _timestamp(segundos=0.0):
+    momento = datetime.now(timezone.utc) + timedelta(seconds=segundos)
+    return momento.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+class FakeGeminiConfig:
+    def __init__(
+        self,
+        generate_latency=0.8,
+        first_token_latency=0.3,
+        chunks=6,
+        upload_latency=0.2,
+        processing_seconds=2.0,
+        jitter=0.25,
+        rate_limit_ratio=0.0,
+        requests_per_minute=None,
+        seed=None,
+    ):
+        self.generate_latency = generate_latency
+        self.first_token_latency = first_token_latency
+        self.chunks = chunks
+        self.upload_latency = upload_latency
+        self.processing_seconds = processing_seconds
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.requests_per_minute = requests_per_minute
+        self.random = random.Random(seed)
+
+
+class FakeGemini:
+    """
+    Servidor en un hilo de fondo; `url` es el valor de `endpoint` para
+    st.secrets["gemini"]. `stats()` retorna los contadores por ruta.
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.config = config or FakeGeminiConfig()
+        self._files = {}
+        self._uploads = {}
+        self._requests = defaultdict(deque)
+        self._counts = defaultdict(int)
+        self._lock = threading.Lock()
+        handler = type("FakeGeminiHandler", (_Handler,), {"fake": self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-gemini", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts)
+
+    def count(self, nombre):
+        with self._lock:
+            self._counts[nombre] += 1
+
+    def delay(self, segundos):
+        if segundos > 0:
+            variacion = self.config.random.uniform(-self.config.jitter, self.config.jitter)
+            time.sleep(max(0.0, segundos * (1 + variacion)))
+
+    def rate_limited(self, api_key):
+        """Decide si la solicitud de `api_key` recibe un 429."""
+        ahora = time.monotonic()
+        with self._lock:
+            if self.config.random.random() < self.config.rate_limit_ratio:
+                return True
+            limite = self.config.requests_per_minute
+            if limite is None:
+                return False
+            ventana = self._requests[api_key]
+            while ventana and ahora - ventana[0] > 60:
+                ventana.popleft()
+            if len(ventana) >= limite:
+                return True
+            ventana.append(ahora)
+            return False
+
+    def discovery_document(self):
+        raiz = self.url + "/"
+        return {
+            "kind": "discovery#restDescription",
+            "discoveryVersion": "v1",
+            "id": "generativelanguage:v1beta",
+            "name": "generativelanguage",
+            "version": "v1beta",
+            "rootUrl": raiz,
+            "servicePath": "",
+            "baseUrl": raiz,
+            "batchPath": "batch",
+            "protocol": "rest",
+            "parameters": {
+                "alt": {"type": "string", "location": "query", "default": "json", "enum": ["json", "media"]},
+                "key": {"type": "string", "location": "query"},
+            },
+            "schemas": {
+                "CreateFileRequest": {
+                    "id": "CreateFileRequest",
+                    "type": "object",
+                    "properties": {"file": {"$ref": "File"}},
+                },
+                "CreateFileResponse": {
+                    "id": "CreateFileResponse",
+                    "type": "object",
+                    "properties": {"file": {"$ref": "File"}},
+                },
+                "File": {
+                    "id": "File",
+                    "type": "object",
+                    "properties": {
+                        "name": {"type": "string"},
+                        "displayName": {"type": "string"},
+                        "mimeType": {"type": "string"},
+                    },
+                },
+            },
+            "resources": {
+                "media": {
+                    "methods": {
+                        "upload": {
+                            "id": "generativelanguage.media.upload",
+                            "path": "v1beta/files",
+                            "flatPath": "v1beta/files",
+                            "httpMethod": "POST",
+                            "parameters": {},
+                            "parameterOrder": [],
+                            "request": {"$ref": "CreateFileRequest"},
+                            "response": {"$ref": "CreateFileResponse"},
+                            "supportsMediaUpload": True,
+                            "mediaUpload": {
+                                "accept": ["*/*"],
+                                "maxSize": "2147483648",
+                                "protocols": {
+                                    "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                                },
+                            },
+                        }
+                    }
+                }
+            },
+        }
+
+    def new_upload(self, metadata):
+        sesion = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[sesion] = metadata
+        return f"{self.url}/upload/v1beta/files?upload_id={sesion}"
+
+    def finish_upload(self, sesion, size):
+        with self._lock:
+            metadata = self._uploads.pop(sesion, {})
+        return self.create_file(metadata, size)
+
+    def create_file(self, metadata, size):
+        self.delay(self.config.upload_latency)
+        name = f"files/{uuid.uuid4().hex[:16]}"
+        archivo = {
+            "name": name,
+            "displayName": metadata.get("displayName", ""),
+            "mimeType": metadata.get("mimeType", "application/octet-stream"),
+            "sizeBytes": str(size),
+            "createTime": _timestamp(),
+            "updateTime": _timestamp(),
+            "expirationTime": _timestamp(48 * 60 * 60),
+            "uri": f"{self.url}/v1beta/{name}",
+            "state": "PROCESSING",
+        }
+        with self._lock:
+            self._files[name] = (archivo, time.monotonic() + self.config.processing_seconds)
+        self.count("upload")
+        return dict(archivo)
+
+    def has_file(self, name):
+        with self._lock:
+            return name in self._files
+
+    def get_file(self, name):
+        with self._lock:
+            entrada = self._files.get(name)
+        if entrada is None:
+            return None
+        archivo, activo_desde = entrada
+        archivo = dict(archivo)
+        if time.monotonic() >= activo_desde:
+            archivo["state"] = "ACTIVE"
+        self.count("get_file")
+        return archivo
+
+
+def _candidate(texto, fin=True):
+    candidato = {"content": {"parts": [{"text": texto}], "role": "model"}, "index": 0}
+    if fin:
+        candidato["finishReason"] = "STOP"
+    return {
+        "candidates": [candidato],
+        "usageMetadata": {"promptTokenCount": 600, "candidatesTokenCount": 80, "totalTokenCount": 680},
+    }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    # ---- utilidades ----
+    def _api_key(self, query):
+        return self.headers.get("x-goog-api-key") or query.get("key", [""])[0]
+
+    def _body(self):
+        largo = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(largo) if largo else b""
+
+    def _json(self, payload, status=200, headers=None):
+        cuerpo = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (headers or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def _error(self, status, estado, mensaje):
+        self._json({"error": {"code": status, "message": mensaje, "status": estado}}, status=status)
+
+    def _rate_limited(self, query):
+        if self.fake.rate_limited(self._api_key(query)):
+            self.fake.count("rate_limited")
+            self._error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).")
+            return True
+        return False
+
+    # ---- rutas ----
+    def do_GET(self):
+        partes = urlsplit(self.path)
+        query = parse_qs(partes.query)
+        if partes.path.endswith("/$discovery/rest"):
+            self._json(self.fake.discovery_document())
+            return
+        coincidencia = re.fullmatch(r"/v1beta/(files/[^/]+)", partes.path)
+        if coincidencia:
+            archivo = self.fake.get_file(coincidencia.group(1))
+            if archivo is None:
+                self._error(404, "NOT_FOUND", "File not found.")
+            else:
+                self._json(archivo)
+            return
+        self._error(404, "NOT_FOUND", f"Unknown path {partes.path}")
+
+    def do_PUT(self):
+        partes = urlsplit(self.path)
+        query = parse_qs(partes.query)
+        if partes.path == "/upload/v1beta/files" and "upload_id" in query:
+            recibido = len(self._body())
+            self._json({"file": self.fake.finish_upload(query["upload_id"][0], recibido)})
+            return
+        self._error(404, "NOT_FOUND", f"Unknown path {partes.path}")
+
+    def do_PATCH(self):
+        partes = urlsplit(self.path)
+        cuerpo = json.loads(self._body() or b"{}")
+        if partes.path.startswith("/v1beta/cachedContents/"):
+            self.fake.count("cache_update")
+            cuerpo["name"] = partes.path[len("/v1beta/"):]
+            cuerpo["expireTime"] = _timestamp(_ttl_seconds(cuerpo))
+            self._json(cuerpo)
+            return
+        self._error(404, "NOT_FOUND", f"Unknown path {partes.path}")
+
+    def do_POST(self):
+        partes = urlsplit(self.path)
+        query = parse_qs(partes.query)
+        if partes.path == "/upload/v1beta/files":
+            self._upload(query)
+            return
+        if partes.path == "/v1beta/cachedContents":
+            cuerpo = json.loads(self._body() or b"{}")
+            self.fake.count("cache_create")
+            cuerpo["name"] = f"cachedContents/{uuid.uuid4().hex[:12]}"
+            cuerpo["expireTime"] = _timestamp(_ttl_seconds(cuerpo))
+            cuerpo.pop("contents", None)
+            self._json(cuerpo)
+            return
+        coincidencia = re.fullmatch(r"/v1beta/models/([^/:]+):(\w+)", partes.path)
+        if coincidencia is None:
+            self._error(404, "NOT_FOUND", f"Unknown path {partes.path}")
+            return
+        metodo = coincidencia.group(2)
+        cuerpo = json.loads(self._body() or b"{}")
+        if metodo == "countTokens":
+            self.fake.count("count_tokens")
+            texto = json.dumps(cuerpo)
+            self._json({"totalTokens": max(1, len(texto) // 4)})
+            return
+        if metodo not in ("generateContent", "streamGenerateContent"):
+            self._error(404, "NOT_FOUND", f"Unknown method {metodo}")
+            return
+        if self._rate_limited(query):
+            return
+        for contenido in cuerpo.get("contents", []):
+            for parte in contenido.get("parts", []):
+                uri = parte.get("fileData", {}).get("fileUri")
+                if uri and not self.fake.has_file(uri.split("/v1beta/", 1)[-1]):
+                    self._error(403, "PERMISSION_DENIED", "You do not have permission to access the File.")
+                    return
+        self.fake.count(metodo)
+        if metodo == "generateContent":
+            self.fake.delay(self.fake.config.generate_latency)
+            self._json(_candidate(RESPONSE_TEXT))
+        else:
+            self._stream()
+
+    def _upload(self, query):
+        tipo = query.get("uploadType", [""])[0]
+        cuerpo = self._body()
+        if tipo == "resumable":
+            metadata = json.loads(cuerpo or b"{}").get("file", {})
+            metadata.setdefault("mimeType", self.headers.get("X-Upload-Content-Type", ""))
+            self.send_response(200)
+            self.send_header("Location", self.fake.new_upload(metadata))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # multipart: metadata JSON y contenido en un solo cuerpo
+        metadata = {}
+        coincidencia = re.search(rb"\{.*?\}\s*\r?\n", cuerpo, re.S)
+        if coincidencia:
+            try:
+                metadata = json.loads(coincidencia.group(0)).get("file", {})
+            except ValueError:
+                pass
+        self._json({"file": self.fake.create_file(metadata, len(cuerpo))})
+
+    def _stream(self):
+        """Respuesta de streamGenerateContent: un arreglo JSON enviado por partes."""
+        config = self.fake.config
+        palabras = RESPONSE_TEXT.split(" ")
+        trozos = max(1, config.chunks)
+        tamanio = -(-len(palabras) // trozos)
+        fragmentos = [" ".join(palabras[i:i + tamanio]) + " " for i in range(0, len(palabras), tamanio)]
+        pausa = max(0.0, config.generate_latency - config.first_token_latency) / len(fragmentos)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.fake.delay(config.first_token_latency)
+        try:
+            self.wfile.write(b"[")
+            for i, fragmento in enumerate(fragmentos):
+                if i:
+                    self.fake.delay(pausa)
+                    self.wfile.write(b",\r\n")
+                self.wfile.write(json.dumps(_candidate(fragmento, fin=i == len(fragmentos) - 1)).encode("utf-8"))
+                self.wfile.flush()
+            self.wfile.write(b"]")
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
@@ -0,0 +1,103 @@
+"""
+Servidor local que imita el endpoint REST de Supabase (PostgREST) para los
+inserts de la app.
+
+Acepta `POST /rest/v1/<tabla>` con una fila o un arreglo de filas y las
+guarda en memoria, con una latencia configurable y una proporción de
+errores 503 para ejercitar los reintentos del `SupabaseWriter`.
+"""
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+# Key con forma de JWT, que es lo que valida `create_client`
+FAKE_KEY = "bench.eyJyb2xlIjoiYW5vbiJ9.bench"
+
+
+class FakeSupabase:
+    def __init__(self, latency=0.05, error_ratio=0.0, host="127.0.0.1", port=0, seed=None):
+        self.latency = latency
+        self.error_ratio = error_ratio
+        self.inserts = 0
+        self.errors = 0
+        self._rows = defaultdict(list)
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        handler = type("FakeSupabaseHandler", (_Handler,), {"fake": self})
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self.url = f"http://{host}:{self._server.server_address[1]}"
+        self.key = FAKE_KEY
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-supabase", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def rows(self, table="responses"):
+        with self._lock:
+            return list(self._rows[table])
+
+    def wait_for_rows(self, count, table="responses", timeout=30.0):
+        """Espera a que lleguen `count` filas (el writer las envía en segundo plano)."""
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            if len(self.rows(table)) >= count:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def insert(self, table, rows):
+        time.sleep(self.latency)
+        with self._lock:
+            if self._random.random() < self.error_ratio:
+                self.errors += 1
+                return False
+            self._rows[table].extend(rows)
+            self.inserts += 1
+            return True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    fake = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        cuerpo = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def do_POST(self):
+        ruta = urlsplit(self.path).path
+        largo = int(self.headers.get("Content-Length") or 0)
+        cuerpo = self.rfile.read(largo) if largo else b""
+        if not ruta.startswith("/rest/v1/"):
+            self._reply(404, {"message": f"Unknown path {ruta}"})
+            return
+        filas = json.loads(cuerpo or b"[]")
+        if isinstance(filas, dict):
+            filas = [filas]
+        if not self.fake.insert(ruta[len("/rest/v1/"):], filas):
+            self._reply(503, {"message": "Service Unavailable"})
+            return
+        self._reply(201, filas)
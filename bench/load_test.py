@@ -0,0 +1,492 @@
+"""
+Benchmark de carga de la app sin red y sin gastar cuota.
+
+Levanta los servidores locales de bench/fake_gemini.py y bench/fake_supabase.py
+y recorre muchas sesiones simuladas en paralelo:
+
+- `form`: cada sesión es un `AppTest` de Streamlit que ejecuta APP.py, llena
+  el formulario con respuestas al azar (con un video en la proporción
+  `--video-ratio`) y presiona Evaluar. Mide el camino completo: subida y
+  activación del video, generación (pool de keys, rotación tras 429, caché
+  de respuestas) y guardado; los tiempos por etapa salen de la columna
+  `timings` de las filas que recibe el Supabase falso.
+- `upload`: recorre solo el camino de video (subida con una key prestada,
+  espera de activación con `wait_for_files_active` y generación con la misma
+  key) desde muchos hilos de un mismo proceso, para aislar la subida y el
+  sondeo de la sobrecarga de Streamlit.
+
+El reporte incluye throughput, p50/p95/p99 por etapa, memoria retenida por
+sesión y los contadores de metrics.py. Con `--output` se guarda en JSON y con
+`--baseline` se compara contra un reporte anterior: el comando termina con
+código 1 si el p95 de alguna etapa o el throughput empeora más que
+`--tolerance`.
+
+Uso, desde la raíz del repositorio:
+
+    python -m bench.load_test --sessions 40 --concurrency 8 --keys 3
+    python -m bench.load_test --scenario upload --sessions 20 --video-mb 5
+    python -m bench.load_test --fake-rpm 10 --output base.json
+    python -m bench.load_test --fake-rpm 10 --baseline base.json
+"""
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+import metrics
+from bench.fake_gemini import FakeGemini, FakeGeminiConfig
+from bench.fake_supabase import FakeSupabase
+from gemini_client import DEFAULT_ROUTES, FAILED_RESPONSES, ROUTE_TEXT
+from questionnaire import (
+    DIARRHEA_QUESTION,
+    GENERAL_QUESTIONS,
+    LANGUAGES,
+    OWNER_QUESTIONS,
+    SPECIES_QUESTION,
+    species_code,
+    species_questions,
+)
+
+APP_PATH = os.path.join(ROOT, "APP.py")
+LANGUAGE_LABEL = "Select Language / Seleccione el idioma:"
+# Diferencia absoluta mínima para considerar que una etapa empeoró
+REGRESSION_FLOOR_SECONDS = 0.01
+
+
+def percentile(values, q):
+    """Percentil `q` (0-100) con interpolación lineal."""
+    if not values:
+        return None
+    ordenados = sorted(values)
+    posicion = (len(ordenados) - 1) * q / 100
+    inferior = int(posicion)
+    superior = min(inferior + 1, len(ordenados) - 1)
+    return ordenados[inferior] + (ordenados[superior] - ordenados[inferior]) * (posicion - inferior)
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+def point_sdk_at(url):
+    """
+    El SDK descarga el documento de discovery de la subida de archivos desde
+    una URL fija de Google, sin mirar `api_endpoint`; se redirige al
+    servidor falso para que el benchmark no salga a la red.
+    """
+    from google.generativeai import client as genai_client
+
+    genai_client.GENAI_API_DISCOVERY_URL = f"{url}/$discovery/rest"
+
+
+def secrets_for(args, fake_gemini, fake_supabase, workdir):
+    gemini = {f"key{i + 1}": f"bench-key-{i + 1}" for i in range(args.keys)}
+    gemini.update(
+        endpoint=fake_gemini.url,
+        requests_per_minute=args.rpm,
+        burst=args.burst,
+        context_cache=args.context_cache,
+        # La caché de contexto solo se usa con el modelo de la ruta; las
+        # sesiones del benchmark son de texto, salvo las de --video-ratio
+        context_cache_model=f"{DEFAULT_ROUTES[ROUTE_TEXT].model}-001",
+    )
+    return {
+        "gemini": gemini,
+        "supabase": {"url": fake_supabase.url, "key": fake_supabase.key},
+        "cache": {
+            "path": os.path.join(workdir, "responses.sqlite3"),
+            "queue_path": os.path.join(workdir, "queue.sqlite3"),
+        },
+        "video": {"preprocess": "off"},
+        "metrics": {"port": 0},
+    }
+
+
+# =================== Escenario form ===================
+def fake_mp4(rng, size):
+    """MP4 mínimo que acepta `inspect_video`: ftyp, moov/mvhd de 10 s y datos al azar."""
+    ftyp = struct.pack(">I4s4sI", 16, b"ftyp", b"isom", 512)
+    mvhd = struct.pack(">I4sB3xIIII", 8 + 20, b"mvhd", 0, 0, 0, 1000, 10_000)
+    moov = struct.pack(">I4s", 8 + len(mvhd), b"moov") + mvhd
+    datos = rng.randbytes(max(size - len(ftyp) - len(moov) - 8, 0))
+    return ftyp + moov + struct.pack(">I4s", 8 + len(datos), b"mdat") + datos
+
+
+def _widget(lista, label):
+    for widget in lista:
+        if widget.label == label:
+            return widget
+    raise LookupError(f"No se encontró el widget {label!r}")
+
+
+def _answer(at, question, lang, rng, session_id):
+    label = question.label[lang]
+    if question.widget == "text":
+        valor = session_id if question.field == "owner_name" else f"{question.field}-{rng.randint(0, 999)}"
+        _widget(at.text_input, label).input(valor)
+    elif question.widget == "number":
+        _widget(at.number_input, label).set_value(rng.randint(question.min_value, question.max_value))
+    else:
+        _widget(at.radio, label).set_value(rng.choice(question.option_labels(lang)))
+
+
+def run_form_session(args, secrets, session_id, rng):
+    """
+    Recorre una sesión completa y retorna `(segundos, app_test)`: el tiempo
+    desde que se presiona Evaluar hasta que termina la página. El `AppTest`
+    se conserva para medir la memoria retenida por sesión.
+    """
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=args.timeout)
+    at.secrets.update(secrets)
+    at.run()
+
+    language = rng.choice(list(LANGUAGES))
+    lang = LANGUAGES[language]
+    _widget(at.radio, LANGUAGE_LABEL).set_value(language)
+    at.run()
+    _answer(at, SPECIES_QUESTION, lang, rng, session_id)
+    if rng.random() < args.video_ratio:
+        # Como en la app, la subida empieza mientras se llena el resto del formulario
+        contenido = fake_mp4(rng, int(args.video_mb * 1024 * 1024))
+        at.file_uploader[0].set_value((f"{session_id}.mp4", contenido, "video/mp4"))
+    at.run()
+
+    especie = species_code(_widget(at.radio, SPECIES_QUESTION.label[lang]).value)
+    for question in (*OWNER_QUESTIONS, *GENERAL_QUESTIONS, DIARRHEA_QUESTION, *species_questions(especie)):
+        _answer(at, question, lang, rng, session_id)
+    at.run()
+
+    inicio = time.perf_counter()
+    at.button[0].click().run()
+    duracion = time.perf_counter() - inicio
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+    return duracion, at
+
+
+def _wait_for_saved_rows(count, timeout):
+    """
+    El guardado es asíncrono y el hilo del writer muere con el proceso: se
+    espera a que Supabase haya recibido `count` filas.
+    """
+    limite = time.monotonic() + timeout
+    while metrics.REGISTRY.value("petscan_supabase_rows_total") < count and time.monotonic() < limite:
+        time.sleep(0.1)
+
+
+def form_worker(args, secrets, worker, sesiones):
+    """
+    Proceso de trabajo del escenario form: corre sus sesiones una tras otra
+    y retorna los tiempos, la memoria por sesión y las métricas del proceso.
+    """
+    point_sdk_at(secrets["gemini"]["endpoint"])
+    rng = random.Random(f"{args.seed}-{worker}")
+    for i in range(args.warmup):
+        run_form_session(args, secrets, f"warmup-{worker}-{i}", rng)
+    _wait_for_saved_rows(args.warmup, args.timeout)
+    # Lo medido durante el calentamiento no cuenta
+    metrics.REGISTRY = metrics.Metrics()
+
+    tracemalloc.start()
+    gc.collect()
+    base, _ = tracemalloc.get_traced_memory()
+    duraciones, errores, vivas = [], [], []
+    for i in sesiones:
+        try:
+            duracion, at = run_form_session(args, secrets, f"bench-{worker}-{i}", rng)
+        except Exception as e:
+            errores.append(f"{type(e).__name__}: {e}")
+            continue
+        duraciones.append(duracion)
+        vivas.append(at)
+    gc.collect()
+    actual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    _wait_for_saved_rows(len(duraciones), args.timeout)
+    return {
+        "durations": duraciones,
+        "errors": errores,
+        "retained_bytes": actual - base,
+        "peak_bytes": pico - base,
+        "metrics": metrics.REGISTRY.snapshot(),
+    }
+
+
+def form_scenario(args, fake_gemini, fake_supabase, workdir):
+    """
+    Streamlit atiende todas las sesiones en un proceso, pero `AppTest`
+    modifica estado global de Streamlit y no admite varias ejecuciones a la
+    vez en el mismo proceso. Cada sesión concurrente corre entonces en su
+    propio proceso, con su propio pool de keys y cachés: equivale a varias
+    réplicas de la app compartiendo la cuota de las mismas keys.
+    """
+    trabajos = [list(range(w, args.sessions, args.concurrency)) for w in range(args.concurrency)]
+    resultados = []
+    contexto = multiprocessing.get_context("spawn")
+    inicio = time.perf_counter()
+    with ProcessPoolExecutor(args.concurrency, mp_context=contexto) as pool:
+        futuros = []
+        for worker, sesiones in enumerate(trabajos):
+            secrets = secrets_for(args, fake_gemini, fake_supabase, workdir)
+            # Cada proceso tiene su propio SupabaseWriter y necesita su propia cola
+            secrets["cache"]["queue_path"] = os.path.join(workdir, f"queue-{worker}.sqlite3")
+            futuros.append(pool.submit(form_worker, args, secrets, worker, sesiones))
+        for futuro in futuros:
+            resultados.append(futuro.result())
+    duracion = time.perf_counter() - inicio
+
+    registro = metrics.Metrics()
+    etapas = {"session": []}
+    errores = []
+    for resultado in resultados:
+        registro.merge(resultado["metrics"])
+        etapas["session"].extend(resultado["durations"])
+        errores.extend(resultado["errors"])
+    completadas = max(len(etapas["session"]), 1)
+    memoria = {
+        "retained_per_session_kib": sum(r["retained_bytes"] for r in resultados) / 1024 / completadas,
+        # Cada proceso corre una sesión a la vez: su pico es el de una sesión
+        "peak_per_concurrent_session_kib": max(r["peak_bytes"] for r in resultados) / 1024,
+    }
+
+    filas = [f for f in fake_supabase.rows() if str(f.get("owner_name", "")).startswith("bench-")]
+    for fila in filas:
+        for etapa, segundos in (fila.get("timings") or {}).items():
+            etapas.setdefault(etapa, []).append(segundos)
+    fallidas = sum(1 for f in filas if f.get("ai_response") in FAILED_RESPONSES)
+    return duracion, etapas, errores, fallidas, memoria, registro
+
+
+# =================== Escenario upload ===================
+def upload_scenario(args, fake_gemini, fake_supabase, workdir):
+    import google.generativeai as genai
+
+    from file_poller import wait_for_files_active
+    from gemini_client import create_model, key_pool_from_config, media_part
+
+    point_sdk_at(fake_gemini.url)
+    pool = key_pool_from_config(secrets_for(args, fake_gemini, fake_supabase, workdir)["gemini"])
+    video = os.path.join(workdir, "video.mp4")
+    with open(video, "wb") as archivo:
+        archivo.write(os.urandom(int(args.video_mb * 1024 * 1024)))
+
+    def una(i):
+        trace = metrics.RequestTrace()
+        with pool.lease() as lease, trace.span("upload"):
+            uploaded = genai.types.File(lease.file_client().create_file(
+                video, mime_type="video/mp4", display_name=f"bench-{i}.mp4"
+            ))
+            file_client = lease.file_client()
+            alias = lease.alias
+        with trace.span("activation"):
+            uploaded, = wait_for_files_active(
+                lambda name: genai.types.File(file_client.get_file(name=name)), [uploaded]
+            )
+        with pool.lease(only=alias) as lease, trace.span("generate"):
+            create_model(lease).generate_content(["Describa el video.", media_part(uploaded)])
+        timings = trace.as_dict()
+        timings["session"] = timings.pop("total")
+        return timings
+
+    for _ in range(args.warmup):
+        una("warmup")
+    metrics.REGISTRY = metrics.Metrics()
+
+    tracemalloc.start()
+    gc.collect()
+    base, _ = tracemalloc.get_traced_memory()
+    etapas = {}
+    errores = []
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        futuros = [executor.submit(una, i) for i in range(args.sessions)]
+        for futuro in futuros:
+            try:
+                timings = futuro.result()
+            except Exception as e:
+                errores.append(f"{type(e).__name__}: {e}")
+                continue
+            for etapa, segundos in timings.items():
+                etapas.setdefault(etapa, []).append(segundos)
+    duracion = time.perf_counter() - inicio
+    gc.collect()
+    actual, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    memoria = {
+        # Las sesiones de este escenario no guardan estado al terminar
+        "retained_per_session_kib": 0.0,
+        "peak_per_concurrent_session_kib": (pico - base) / 1024 / args.concurrency,
+    }
+    return duracion, etapas, errores, 0, memoria, metrics.REGISTRY
+
+
+# =================== Reporte ===================
+COUNTERS = (
+    "petscan_gemini_retries_total",
+    "petscan_key_switches_total",
+    "petscan_hedged_requests_total",
+    "petscan_hedge_wins_total",
+    "petscan_gemini_errors_total",
+    "petscan_errors_total",
+    "petscan_supabase_rows_total",
+)
+
+
+def build_report(args, duracion, etapas, errores, fallidas, memoria, registro, fake_gemini, fake_supabase):
+    completadas = len(etapas.get("session", []))
+    contadores = {nombre: registro.value(nombre) for nombre in COUNTERS}
+    for cache in ("upload", "response", "context"):
+        for resultado in ("hit", "miss"):
+            contadores[f"cache_{cache}_{resultado}"] = registro.value(
+                "petscan_cache_requests_total", cache=cache, result=resultado
+            )
+    supabase_insert = {
+        f"p{q}": registro.quantile(metrics.STAGE_HISTOGRAM, q / 100, stage="supabase_insert")
+        for q in (50, 95, 99)
+    }
+    return {
+        "scenario": args.scenario,
+        "config": {
+            "sessions": args.sessions,
+            "concurrency": args.concurrency,
+            "keys": args.keys,
+            "video_ratio": args.video_ratio,
+            "fake_rpm": args.fake_rpm,
+            "rate_limit_ratio": args.rate_limit_ratio,
+            "latency": args.latency,
+        },
+        "duration_seconds": duracion,
+        "completed": completadas,
+        "errors": len(errores),
+        "error_samples": errores[:5],
+        "failed_responses": fallidas,
+        "throughput_per_second": completadas / duracion if duracion else 0.0,
+        "stages": {etapa: summarize(valores) for etapa, valores in sorted(etapas.items())},
+        # Estimado desde el histograma: el insert ocurre en el hilo del writer
+        "supabase_insert_estimate": supabase_insert,
+        "memory": memoria,
+        "counters": contadores,
+        "fake_gemini": fake_gemini.stats(),
+        "fake_supabase": {"inserts": fake_supabase.inserts, "errors": fake_supabase.errors},
+    }
+
+
+def print_report(report):
+    print(f"Escenario {report['scenario']}: {report['completed']} sesiones en "
+          f"{report['duration_seconds']:.1f} s ({report['throughput_per_second']:.2f}/s), "
+          f"{report['errors']} errores, {report['failed_responses']} respuestas fallidas")
+    print(f"{'etapa':<18}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for etapa, resumen in report["stages"].items():
+        if not resumen["count"]:
+            continue
+        print(f"{etapa:<18}{resumen['count']:>6}"
+              f"{resumen['p50']:>10.3f}{resumen['p95']:>10.3f}{resumen['p99']:>10.3f}")
+    memoria = report["memory"]
+    print(f"memoria retenida por sesión: {memoria['retained_per_session_kib']:.0f} KiB, "
+          f"pico por sesión concurrente: {memoria['peak_per_concurrent_session_kib']:.0f} KiB")
+    for nombre, valor in report["counters"].items():
+        print(f"{nombre}: {valor}")
+    for error in report["error_samples"]:
+        print(f"error: {error}")
+
+
+def compare(report, baseline, tolerance):
+    """Lista de regresiones de `report` respecto de `baseline`."""
+    regresiones = []
+    for etapa, anterior in baseline.get("stages", {}).items():
+        actual = report["stages"].get(etapa)
+        if not actual or actual["p95"] is None or anterior.get("p95") is None:
+            continue
+        limite = anterior["p95"] * (1 + tolerance) + REGRESSION_FLOOR_SECONDS
+        if actual["p95"] > limite:
+            regresiones.append(f"{etapa}: p95 {actual['p95']:.3f} s > {anterior['p95']:.3f} s")
+    anterior = baseline.get("throughput_per_second") or 0.0
+    if report["throughput_per_second"] < anterior * (1 - tolerance):
+        regresiones.append(
+            f"throughput {report['throughput_per_second']:.2f}/s < {anterior:.2f}/s"
+        )
+    return regresiones
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scenario", choices=("form", "upload"), default="form")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--warmup", type=int, default=1, help="sesiones previas que no se miden")
+    parser.add_argument("--keys", type=int, default=3, help="API keys falsas en el pool")
+    parser.add_argument("--rpm", type=int, default=600, help="límite por key del pool de la app")
+    parser.add_argument("--burst", type=int, default=20)
+    parser.add_argument("--fake-rpm", type=int, default=None, help="cuota por key del Gemini falso (429 al pasarla)")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="proporción de 429 al azar")
+    parser.add_argument("--latency", type=float, default=0.8, help="segundos de generación del Gemini falso")
+    parser.add_argument("--first-token", type=float, default=0.3)
+    parser.add_argument("--processing", type=float, default=2.0, help="segundos en PROCESSING de cada archivo")
+    parser.add_argument("--supabase-latency", type=float, default=0.05)
+    parser.add_argument("--supabase-error-ratio", type=float, default=0.0)
+    parser.add_argument("--video-ratio", type=float, default=0.0, help="proporción de sesiones del escenario form con video")
+    parser.add_argument("--video-mb", type=float, default=2.0)
+    parser.add_argument("--context-cache", action="store_true")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="guarda el reporte en JSON")
+    parser.add_argument("--baseline", help="reporte JSON anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = FakeGeminiConfig(
+        generate_latency=args.latency,
+        first_token_latency=args.first_token,
+        processing_seconds=args.processing,
+        rate_limit_ratio=args.rate_limit_ratio,
+        requests_per_minute=args.fake_rpm,
+        seed=args.seed,
+    )
+    escenario = form_scenario if args.scenario == "form" else upload_scenario
+    with tempfile.TemporaryDirectory(prefix="petscan-bench-") as workdir, \
+            FakeGemini(config) as fake_gemini, \
+            FakeSupabase(args.supabase_latency, args.supabase_error_ratio, seed=args.seed) as fake_supabase:
+        duracion, etapas, errores, fallidas, memoria, registro = escenario(args, fake_gemini, fake_supabase, workdir)
+        report = build_report(
+            args, duracion, etapas, errores, fallidas, memoria, registro, fake_gemini, fake_supabase
+        )
+
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as archivo:
+            json.dump(report, archivo, indent=2, ensure_ascii=False)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as archivo:
+            regresiones = compare(report, json.load(archivo), args.tolerance)
+        for regresion in regresiones:
+            print(f"REGRESIÓN {regresion}")
+        return 1 if regresiones else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
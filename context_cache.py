@@ -0,0 +1,124 @@
+"""
+Caché de contexto de Gemini para la parte fija del prompt.
+
+Los criterios de evaluación y las instrucciones de tono son iguales en todas
+las evaluaciones de un mismo idioma. En este modo se registran una vez como
+"cached content" en Gemini y cada solicitud envía solo las respuestas de la
+mascota, lo que reduce los tokens de entrada y el tiempo de prefill.
+
+El contenido en caché pertenece al proyecto de la key que lo crea, así que se
+guarda uno por key e idioma. Cada entrada tiene un TTL en Gemini que se
+extiende cuando está por vencer. Si la API rechaza la creación (por ejemplo,
+porque el texto no alcanza el mínimo de tokens cacheables del modelo) se
+recuerda el fallo por un tiempo y las solicitudes usan el prompt completo.
+"""
+import datetime
+import hashlib
+import threading
+import time
+
+DEFAULT_TTL_SECONDS = 60 * 60
+# Se extiende el TTL cuando quedan menos de estos segundos
+REFRESH_MARGIN_SECONDS = 5 * 60
+# Tiempo antes de volver a intentar crear una caché que falló
+FAILURE_BACKOFF_SECONDS = 30 * 60
+
+
+def is_stale_cache_error(exc):
+    """
+    Decide si un error al generar con un cached content indica que ese
+    contenido ya no existe o no es usable (vencido, borrado, de otro
+    proyecto). Los errores de cuota, red o servidor no dicen nada de la
+    caché: la entrada se conserva y la solicitud sigue la rotación de keys.
+    """
+    from google.api_core import exceptions as api_exceptions
+
+    if isinstance(exc, (api_exceptions.NotFound, api_exceptions.PermissionDenied)):
+        return True
+    return isinstance(exc, api_exceptions.InvalidArgument) and "cache" in str(exc).lower()
+
+
+class ContextCacheManager:
+    def __init__(self, model_name, ttl=DEFAULT_TTL_SECONDS):
+        self.model_name = model_name
+        self.ttl = ttl
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+        self._entries = {}
+        self._failed_until = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def cached_content_name(self, lease, prefix):
+        """
+        Retorna el nombre del cached content con `prefix` para la key
+        prestada, creándolo o extendiendo su TTL si hace falta, o None si
+        no se puede usar y hay que enviar el prompt completo.
+        """
+        clave = (lease.alias, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+        with self._lock:
+            if self._failed_until.get(clave, 0.0) > time.monotonic():
+                return None
+            candado = self._locks.setdefault(clave, threading.Lock())
+
+        # Una sola creación por key y prefijo aunque lleguen varias sesiones
+        with candado:
+            with self._lock:
+                entrada = self._entries.get(clave)
+            ahora = time.monotonic()
+            try:
+                if entrada is None or entrada[1] <= ahora:
+                    entrada = self._create(lease, prefix)
+                elif entrada[1] - ahora < REFRESH_MARGIN_SECONDS:
+                    entrada = self._refresh(lease, entrada[0])
+            except Exception:
+                with self._lock:
+                    self.failures += 1
+                    self._entries.pop(clave, None)
+                    self._failed_until[clave] = time.monotonic() + FAILURE_BACKOFF_SECONDS
+                return None
+            with self._lock:
+                self._entries[clave] = entrada
+            return entrada[0]
+
+    def invalidate(self, alias, prefix):
+        """Olvida la entrada de la key para que la próxima solicitud la recree."""
+        clave = (alias, hashlib.sha256(prefix.encode("utf-8")).hexdigest())
+        with self._lock:
+            self._entries.pop(clave, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "created": self.created,
+                "refreshed": self.refreshed,
+                "failures": self.failures,
+            }
+
+    def _create(self, lease, prefix):
+        from google.generativeai import protos
+
+        cached = lease.cache_client().create_cached_content(
+            cached_content=protos.CachedContent(
+                model=f"models/{self.model_name}",
+                contents=[protos.Content(role="user", parts=[protos.Part(text=prefix)])],
+                ttl=datetime.timedelta(seconds=self.ttl),
+            )
+        )
+        with self._lock:
+            self.created += 1
+        return cached.name, time.monotonic() + self.ttl
+
+    def _refresh(self, lease, name):
+        from google.generativeai import protos
+        from google.protobuf import field_mask_pb2
+
+        lease.cache_client().update_cached_content(
+            cached_content=protos.CachedContent(name=name, ttl=datetime.timedelta(seconds=self.ttl)),
+            update_mask=field_mask_pb2.FieldMask(paths=["ttl"]),
+        )
+        with self._lock:
+            self.refreshed += 1
+        return name, time.monotonic() + self.ttl
@@ -0,0 +1,100 @@
+"""
+Espera en segundo plano a que los archivos subidos a Gemini estén activos.
+
+Un clip corto suele estar listo en uno o dos segundos, así que la consulta
+empieza con intervalos cortos que crecen exponencialmente hasta un tope, con
+un plazo máximo total. Los archivos pendientes se consultan en paralelo y
+todo el trabajo corre en hilos de fondo: la sesión solo guarda un `Future`
+y recoge el resultado al momento de evaluar.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+INITIAL_INTERVAL_SECONDS = 0.5
+MAX_INTERVAL_SECONDS = 8.0
+BACKOFF_FACTOR = 2.0
+DEADLINE_SECONDS = 300.0
+
+
+class FileProcessingError(Exception):
+    """Gemini terminó de procesar el archivo pero no quedó activo."""
+
+
+def wait_for_files_active(
+    get_file,
+    files,
+    initial_interval=INITIAL_INTERVAL_SECONDS,
+    max_interval=MAX_INTERVAL_SECONDS,
+    backoff=BACKOFF_FACTOR,
+    deadline=DEADLINE_SECONDS,
+):
+    """
+    Consulta con `get_file(name)` hasta que todos los archivos estén activos
+    y los retorna actualizados, en el mismo orden.
+
+    Lanza `FileProcessingError` si alguno falla y `TimeoutError` si no
+    terminan dentro de `deadline` segundos.
+    """
+    files = list(files)
+    limite = time.monotonic() + deadline
+    interval = initial_interval
+    with ThreadPoolExecutor(max_workers=max(1, len(files))) as executor:
+        while True:
+            pendientes = []
+            for i, file in enumerate(files):
+                if file.state.name == "PROCESSING":
+                    pendientes.append(i)
+                elif file.state.name != "ACTIVE":
+                    raise FileProcessingError(f"El archivo {file.name} falló al procesarse")
+            if not pendientes:
+                return files
+
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                raise TimeoutError(f"Los archivos no se activaron en {deadline:g} segundos")
+            time.sleep(min(interval, restante))
+            interval = min(interval * backoff, max_interval)
+
+            actualizados = executor.map(get_file, [files[i].name for i in pendientes])
+            for i, file in zip(pendientes, actualizados):
+                files[i] = file
+
+
+class BackgroundUploads:
+    """
+    Ejecuta subidas y esperas de activación en hilos de fondo, con una sola
+    tarea en curso por hash de contenido aunque varias sesiones la pidan.
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-upload")
+        self._running = {}
+        # Reentrante: si la tarea ya terminó, add_done_callback ejecuta
+        # _forget en este mismo hilo mientras se tiene el candado
+        self._lock = threading.RLock()
+
+    def get(self, digest):
+        with self._lock:
+            return self._running.get(digest)
+
+    def submit(self, digest, fn, *args):
+        """
+        Retorna `(future, creado)`; `creado` es falso si ya había una tarea
+        en curso para ese hash y `fn` no se ejecutará.
+        """
+        with self._lock:
+            future = self._running.get(digest)
+            if future is not None:
+                return future, False
+            future = self._executor.submit(fn, *args)
+            self._running[digest] = future
+            future.add_done_callback(lambda f: self._forget(digest, f))
+            return future, True
+
+    def _forget(self, digest, future):
+        # Al terminar, el resultado queda en la caché de subidas; si falló,
+        # la siguiente solicitud puede volver a intentarlo.
+        with self._lock:
+            if self._running.get(digest) is future:
+                del self._running[digest]
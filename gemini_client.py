@@ -0,0 +1,460 @@
+"""
+Generación con Gemini sin depender de la interfaz.
+
+La app de Streamlit y el modo por lotes (batch.py) comparten aquí la
+configuración del modelo, la construcción del pool de keys y de la caché de
+contexto a partir de la sección [gemini] de los secrets, y el ciclo de envío
+con reintentos sobre el pool. La app solo agrega lo propio de la página:
+mostrar los fragmentos de la respuesta a medida que llegan.
+"""
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+
+import metrics
+from context_cache import (
+    DEFAULT_TTL_SECONDS as CONTEXT_CACHE_TTL_SECONDS,
+    ContextCacheManager,
+    is_stale_cache_error,
+)
+from gemini_keys import (
+    ApiKeyPool,
+    DEFAULT_BURST,
+    DEFAULT_REQUESTS_PER_MINUTE,
+    ERROR_REQUEST,
+    NoApiKeyAvailable,
+    classify_error,
+)
+
+GENERATION_CONFIG = {
+    "temperature": 0.4,
+    "top_p": 0.8,
+    "top_k": 32,
+    "max_output_tokens": 8000,
+}
+
+SAFETY_SETTINGS = [
+    {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_ONLY_HIGH"},
+    {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_ONLY_HIGH"},
+]
+
+MODEL_NAME = "gemini-2.0-flash"
+# Cambiar cuando cambie el texto del prompt, para invalidar la caché de respuestas
+PROMPT_VERSION = 4
+NO_RESPONSE = "Sin respuesta."
+ERROR_RESPONSE = "Error al procesar la solicitud."
+FAILED_RESPONSES = (NO_RESPONSE, ERROR_RESPONSE)
+
+
+def key_pool_from_config(config):
+    """
+    Pool con todas las entradas `key*` de la sección [gemini]. Con
+    `endpoint` los clientes hablan REST con ese servidor en lugar de la API
+    de Google (lo usa el benchmark de bench/).
+    """
+    api_keys = {
+        nombre: valor for nombre, valor in sorted(config.items())
+        if nombre.startswith("key")
+    }
+    client_config = None
+    if config.get("endpoint"):
+        client_config = {"transport": "rest", "client_options": {"api_endpoint": config["endpoint"]}}
+    return ApiKeyPool(
+        api_keys,
+        requests_per_minute=config.get("requests_per_minute", DEFAULT_REQUESTS_PER_MINUTE),
+        burst=config.get("burst", DEFAULT_BURST),
+        client_config=client_config,
+    )
+
+
+def context_cache_from_config(config):
+    """
+    Caché de contexto para el prefijo fijo del prompt, o None si el modo está
+    apagado. Se activa con context_cache = true; el modelo debe tener versión
+    explícita (context_cache_model).
+    """
+    if not config.get("context_cache", False):
+        return None
+    return ContextCacheManager(
+        config.get("context_cache_model", f"{MODEL_NAME}-001"),
+        ttl=config.get("context_cache_ttl", CONTEXT_CACHE_TTL_SECONDS),
+    )
+
+
+def create_model(lease, cached_content=None, model_name=MODEL_NAME, max_output_tokens=None):
+    """
+    Crea el modelo ligado al cliente de la key prestada, sin modificar la
+    configuración global de genai que comparten las demás sesiones. Con
+    `cached_content` el modelo usa ese prefijo ya registrado en Gemini, que
+    pertenece a `model_name`. `max_output_tokens` reemplaza el tope de
+    GENERATION_CONFIG (lo fija cada ruta).
+    """
+    import google.generativeai as genai
+
+    generation_config = GENERATION_CONFIG
+    if max_output_tokens:
+        generation_config = {**GENERATION_CONFIG, "max_output_tokens": max_output_tokens}
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        generation_config=generation_config,
+        safety_settings=SAFETY_SETTINGS
+    )
+    model._client = lease.generative_client()
+    if cached_content:
+        # Equivale a GenerativeModel.from_cached_content, que consulta la
+        # caché con el cliente global en lugar del de la key prestada
+        model._cached_content = cached_content
+    return model
+
+
+def count_tokens(key_pool, texto):
+    """
+    Cuenta los tokens de un texto con la API de Gemini.
+    """
+    with key_pool.lease() as lease, metrics.span("count_tokens"):
+        return create_model(lease).count_tokens(texto).total_tokens
+
+
+def media_part(media):
+    """
+    Parte del contenido que referencia un archivo ya subido a Gemini.
+    """
+    import google.generativeai as genai
+
+    return genai.protos.Part(
+        file_data=genai.protos.FileData(mime_type=media.mime_type, file_uri=media.uri)
+    )
+
+
+@dataclass(frozen=True)
+class Route:
+    """
+    Modelo y límites para un tipo de evaluación. `hedge_model` es el modelo
+    de la solicitud duplicada (por defecto el mismo); `hedge_after` es la
+    espera antes de duplicar mientras no haya suficientes mediciones para
+    usar el p95.
+    """
+    name: str
+    model: str
+    timeout: float
+    max_output_tokens: int
+    hedge: bool = True
+    hedge_model: str = None
+    hedge_after: float = 8.0
+
+
+ROUTE_TEXT = "text"
+ROUTE_MEDIA = "media"
+
+# Los cuestionarios sin video no necesitan un modelo multimodal completo
+DEFAULT_ROUTES = {
+    ROUTE_TEXT: Route(ROUTE_TEXT, "gemini-2.0-flash-lite", timeout=60.0, max_output_tokens=2048, hedge_model=MODEL_NAME),
+    ROUTE_MEDIA: Route(ROUTE_MEDIA, MODEL_NAME, timeout=120.0, max_output_tokens=8000, hedge_after=20.0),
+}
+
+
+def routes_from_config(config):
+    """
+    Rutas por defecto con lo que defina la sección [gemini.routes.<ruta>]
+    (model, timeout, max_output_tokens, hedge, hedge_model, hedge_after).
+    """
+    rutas = dict(DEFAULT_ROUTES)
+    for nombre, valores in config.get("routes", {}).items():
+        if nombre in rutas:
+            rutas[nombre] = replace(rutas[nombre], **valores)
+    return rutas
+
+
+def choose_route(routes, media=None):
+    return routes[ROUTE_MEDIA if media is not None else ROUTE_TEXT]
+
+
+class LatencyTracker:
+    """
+    Tiempos recientes hasta el primer fragmento de cada ruta; su p95 es el
+    plazo tras el cual se envía una solicitud duplicada.
+    """
+
+    def __init__(self, window=200, min_samples=20, min_delay=0.5):
+        self.window = window
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, seconds):
+        with self._lock:
+            self._samples.setdefault(route.name, deque(maxlen=self.window)).append(seconds)
+
+    def hedge_delay(self, route):
+        with self._lock:
+            muestras = sorted(self._samples.get(route.name, ()))
+        if len(muestras) < self.min_samples:
+            return route.hedge_after
+        return max(self.min_delay, muestras[int(0.95 * (len(muestras) - 1))])
+
+
+LATENCY = LatencyTracker()
+
+
+class _Attempts:
+    """
+    Solicitudes en streaming de una misma ronda, cada una en su hilo. Los
+    hilos solo publican eventos `(intento, tipo, valor)` en una cola; quien
+    consume decide cuál gana y cancela las demás, que dejan de leer su
+    stream y devuelven la key.
+    """
+
+    def __init__(self, key_pool, route, context_cache, prompt, prefix, media):
+        self.key_pool = key_pool
+        self.route = route
+        self.context_cache = context_cache
+        self.prompt = prompt
+        self.prefix = prefix
+        self.media = media
+        self.events = queue.Queue()
+        self.aliases = {}
+        self.models = {}
+        self._cancelled = {}
+
+    def start(self, exclude, model_name, usar_cache):
+        intento = len(self._cancelled)
+        self._cancelled[intento] = threading.Event()
+        self.models[intento] = model_name
+        threading.Thread(
+            target=self._run,
+            args=(intento, set(exclude), model_name, usar_cache),
+            name=f"gemini-{self.route.name}-{intento}",
+            daemon=True,
+        ).start()
+        return intento
+
+    def cancel(self, excepto=None):
+        for intento, cancelado in self._cancelled.items():
+            if intento != excepto:
+                cancelado.set()
+
+    @property
+    def started(self):
+        return len(self._cancelled)
+
+    def _run(self, intento, exclude, model_name, usar_cache):
+        cancelado = self._cancelled[intento]
+        cached_content = None
+        only = self.media.key_alias if self.media else None
+        try:
+            with self.key_pool.lease(exclude=exclude, only=only) as lease:
+                self.aliases[intento] = lease.alias
+                self.events.put((intento, "lease", lease.alias))
+                if usar_cache and model_name == self.route.model:
+                    cached_content = self.context_cache.cached_content_name(lease, self.prefix)
+                    metrics.inc(
+                        "petscan_cache_requests_total", help="Consultas a las cachés por resultado.",
+                        cache="context", result="hit" if cached_content else "miss",
+                    )
+                if cached_content:
+                    model = create_model(
+                        lease, cached_content, self.context_cache.model_name, self.route.max_output_tokens
+                    )
+                else:
+                    model = create_model(lease, model_name=model_name, max_output_tokens=self.route.max_output_tokens)
+                texto_prompt = self.prompt[len(self.prefix):] if cached_content else self.prompt
+                contents = [texto_prompt, media_part(self.media)] if self.media else [texto_prompt]
+                if cancelado.is_set():
+                    # Otro intento ganó mientras este esperaba una key
+                    self.events.put((intento, "done", None))
+                    return
+                metrics.inc(
+                    "petscan_gemini_requests_total", help="Solicitudes de generación por key.",
+                    key=lease.alias, model=model_name,
+                )
+                response = model.generate_content(
+                    contents, stream=True, request_options={"timeout": self.route.timeout}
+                )
+                for chunk in response:
+                    if cancelado.is_set():
+                        # Se deja de leer: la conexión se cierra con la respuesta
+                        break
+                    if chunk.parts:
+                        self.events.put((intento, "chunk", chunk.text))
+            self.events.put((intento, "done", None))
+        except Exception as e:
+            self.events.put((intento, "error", (e, self.aliases.get(intento), bool(cached_content))))
+
+
+class _AttemptFailed(Exception):
+    def __init__(self, error, alias, cached):
+        super().__init__(str(error))
+        self.error = error
+        self.alias = alias
+        self.cached = cached
+
+
+def _race(attempts, key_pool, route, latency, trace, exclude, usar_cache):
+    """
+    Corre una ronda con posible solicitud duplicada y entrega el texto del
+    intento que produce primero un fragmento.
+    """
+    fallidas = set(exclude)
+    attempts.start(exclude, route.model, usar_cache)
+    # Con video solo sirve la key que lo subió, así que el duplicado la repite
+    puede_duplicar = route.hedge and (attempts.media is not None or key_pool.size > 1 or route.hedge_model)
+    # Los plazos corren desde que el primer intento obtiene una key: la
+    # espera por cuota la acota el pool (acquire_timeout)
+    inicio = duplicar_en = limite = None
+    activos = 1
+    ganador = None
+    while ganador is None:
+        ahora = time.monotonic()
+        if limite is not None and ahora >= limite:
+            attempts.cancel()
+            metrics.inc("petscan_gemini_timeouts_total", help="Rondas sin respuesta dentro del plazo.", route=route.name)
+            raise _AttemptFailed(TimeoutError(f"Sin respuesta de Gemini en {route.timeout:.0f} s"), None, False)
+        if duplicar_en is not None and ahora >= duplicar_en:
+            duplicar_en = None
+            if not key_pool.saturated():
+                excluir = set(exclude) | set(attempts.aliases.values())
+                attempts.start(excluir, route.hedge_model or route.model, usar_cache)
+                activos += 1
+                metrics.inc("petscan_hedged_requests_total", help="Solicitudes duplicadas por lentitud.", route=route.name)
+            continue
+        plazos = [t for t in (duplicar_en, limite) if t is not None]
+        try:
+            intento, tipo, valor = attempts.events.get(timeout=max(min(plazos) - ahora, 0.0) if plazos else None)
+        except queue.Empty:
+            continue
+        if tipo == "lease":
+            if intento == 0:
+                inicio = time.monotonic()
+                limite = inicio + route.timeout
+                if puede_duplicar:
+                    duplicar_en = inicio + latency.hedge_delay(route)
+                if fallidas and valor not in fallidas:
+                    metrics.inc("petscan_key_switches_total", help="Cambios de API key tras un error.")
+            exclude.add(valor)
+        elif tipo == "error":
+            # Si fallan todos los intentos en curso, la ronda falla sin
+            # esperar al duplicado y `generate` reintenta con otra key
+            activos -= 1
+            if activos == 0:
+                raise _AttemptFailed(*valor)
+        else:
+            ganador = intento
+            attempts.cancel(excepto=ganador)
+            segundos = time.monotonic() - inicio
+            latency.observe(route, segundos)
+            if trace is not None:
+                trace.record("first_token", segundos)
+                trace.attributes["api_key"] = attempts.aliases.get(ganador, "")
+                trace.attributes["model"] = attempts.models[ganador]
+                trace.attributes["route"] = route.name
+                trace.attributes["hedged"] = attempts.started > 1
+            if ganador:
+                metrics.inc("petscan_hedge_wins_total", help="Duplicados que respondieron primero.", route=route.name)
+            if tipo == "chunk":
+                yield valor
+            else:
+                return
+
+    while True:
+        try:
+            intento, tipo, valor = attempts.events.get(timeout=route.timeout)
+        except queue.Empty:
+            attempts.cancel()
+            raise _AttemptFailed(TimeoutError("El stream de Gemini dejó de responder"), None, False)
+        if intento != ganador:
+            continue
+        if tipo == "chunk":
+            yield valor
+        elif tipo == "done":
+            return
+        elif tipo == "error":
+            raise _AttemptFailed(*valor)
+
+
+def generate(
+    prompt,
+    key_pool,
+    context_cache=None,
+    media=None,
+    prefix=None,
+    trace=None,
+    render_stream=None,
+    on_retry=None,
+    route=None,
+    latency=LATENCY,
+):
+    """
+    Envía el prompt a Gemini y retorna el texto completo de la respuesta, o
+    uno de `FAILED_RESPONSES`.
+
+    `route` fija el modelo, el plazo y el tope de tokens de salida (por
+    defecto, según haya o no `media`). Si el primer fragmento no llega en el
+    p95 reciente de la ruta se envía una solicitud duplicada con otra key (o
+    con `hedge_model`) y se usa la que responda primero; la otra se cancela.
+
+    Si hay caché de contexto y el prompt empieza con `prefix`, ese prefijo
+    se toma del cached content de la key y solo se envía el resto; si la
+    caché no está disponible se envía el prompt completo.
+
+    `media` es la entrada de la caché de subidas con el video (o la hoja de
+    cuadros clave) que se adjunta al prompt; solo la key que lo subió puede
+    leerlo, así que en ese caso se usa siempre esa key.
+
+    Con `render_stream` los fragmentos se entregan a medida que llegan:
+    recibe el iterador de fragmentos de texto y retorna el texto completo.
+    Si el intento falla se llama a `on_retry` (por ejemplo, para borrar el
+    texto parcial) y se vuelve a generar la respuesta completa con otra key.
+
+    `trace` recibe los tiempos de generación, la key y el modelo que
+    respondieron.
+    """
+    route = route or choose_route(DEFAULT_ROUTES, media)
+    # Un cached content solo sirve con el modelo para el que se creó
+    usar_cache = (
+        context_cache is not None and prefix is not None and prompt.startswith(prefix)
+        and context_cache.model_name.startswith(route.model)
+    )
+    keys_usadas = set()
+    # Una ronda por key; reintentar sin el cached content no cuenta como ronda
+    rondas = key_pool.size
+    intento = 0
+    while intento < rondas:
+        intento += 1
+        if intento > 1:
+            metrics.inc("petscan_gemini_retries_total", help="Reintentos de generación con otra key.")
+        attempts = _Attempts(key_pool, route, context_cache, prompt, prefix, media)
+        fragmentos = _race(attempts, key_pool, route, latency, trace, set(keys_usadas), usar_cache)
+        try:
+            with metrics.span("generate", trace):
+                if render_stream is None:
+                    texto = "".join(fragmentos)
+                else:
+                    texto = render_stream(fragmentos)
+            texto = texto.strip() if isinstance(texto, str) else ""
+            return texto or NO_RESPONSE
+        except _AttemptFailed as fallo:
+            error = fallo.error
+            if fallo.alias:
+                keys_usadas.add(fallo.alias)
+            keys_usadas.update(attempts.aliases.values())
+            if isinstance(error, NoApiKeyAvailable):
+                break
+            metrics.inc("petscan_gemini_errors_total", help="Errores de Gemini por tipo.", kind=classify_error(error))
+            if on_retry is not None:
+                on_retry()
+            if fallo.cached and is_stale_cache_error(error):
+                # El cached content venció o se borró: se reintenta sin él
+                context_cache.invalidate(fallo.alias, prefix)
+                keys_usadas.discard(fallo.alias)
+                usar_cache = False
+                rondas += 1
+                continue
+            # Un error del propio prompt fallaría igual con otra key
+            if classify_error(error) == ERROR_REQUEST:
+                break
+    return ERROR_RESPONSE
@@ -0,0 +1,277 @@
+"""
+Pool de API keys de Gemini compartido por todas las sesiones del proceso.
+
+Streamlit atiende cada sesión en su propio hilo, así que la key no puede ser
+estado global de `genai.configure`: cada solicitud toma una key del pool
+(`lease`) y usa clientes ligados a esa key. Cada key tiene un limitador de
+tipo token bucket y un periodo de enfriamiento tras errores de cuota o de
+autenticación; el pool entrega siempre la key sana con menos carga.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+# Límites por defecto del plan gratuito de gemini-2.0-flash
+DEFAULT_REQUESTS_PER_MINUTE = 15
+DEFAULT_BURST = 5
+
+BASE_COOLDOWN_SECONDS = 30
+MAX_COOLDOWN_SECONDS = 15 * 60
+# Errores de red seguidos que se toleran antes de enfriar la key
+TRANSIENT_FAILURE_LIMIT = 3
+
+# Tipos de error según su efecto sobre la key
+ERROR_RATE_LIMIT = "rate_limit"
+ERROR_AUTH = "auth"
+ERROR_TRANSIENT = "transient"
+ERROR_REQUEST = "request"
+
+
+class NoApiKeyAvailable(Exception):
+    """No hay ninguna key disponible antes del tiempo límite."""
+
+
+def classify_error(exc):
+    """
+    Clasifica una excepción de Gemini para decidir si la key es culpable.
+
+    Solo los errores de cuota, de autenticación y de red afectan la salud de
+    la key; un prompt bloqueado o inválido falla igual con cualquier key.
+    """
+    from google.api_core import exceptions as api_exceptions
+    from requests.exceptions import ConnectionError
+    from urllib3.exceptions import ProtocolError
+
+    if isinstance(exc, (api_exceptions.TooManyRequests, api_exceptions.ResourceExhausted)):
+        return ERROR_RATE_LIMIT
+    if isinstance(exc, (api_exceptions.Unauthenticated, api_exceptions.PermissionDenied)):
+        return ERROR_AUTH
+    if isinstance(exc, api_exceptions.InvalidArgument) and "API key" in str(exc):
+        return ERROR_AUTH
+    if isinstance(exc, (
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+        api_exceptions.InternalServerError,
+        ConnectionError,
+        ProtocolError,
+        TimeoutError,
+    )):
+        return ERROR_TRANSIENT
+    return ERROR_REQUEST
+
+
+class TokenBucket:
+    """
+    Limitador de tasa: `rate_per_minute` fichas por minuto, con ráfagas de
+    hasta `capacity`. No es thread-safe por sí solo; lo protege el pool.
+    """
+
+    def __init__(self, rate_per_minute, capacity):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def available(self, now):
+        self._refill(now)
+        return self.tokens
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1.0
+
+    def seconds_until_token(self, now):
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+
+class ApiKeyState:
+    def __init__(self, alias, api_key, requests_per_minute, burst, client_config=None):
+        self.alias = alias
+        self.api_key = api_key
+        self.client_config = client_config or {}
+        self.bucket = TokenBucket(requests_per_minute, burst)
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+        self.last_error = ""
+        self._clients = None
+        self._clients_lock = threading.Lock()
+
+    def client(self, name):
+        """
+        Cliente del SDK ligado a esta key ("generative", "file", ...).
+
+        El SDK solo expone clientes configurados globalmente; aquí se usa un
+        `_ClientManager` propio por key para no tocar `genai.configure`.
+        """
+        with self._clients_lock:
+            if self._clients is None:
+                from google.generativeai import client as genai_client
+
+                manager = genai_client._ClientManager()
+                manager.configure(api_key=self.api_key, **self.client_config)
+                self._clients = manager
+            return self._clients.get_default_client(name)
+
+
+class KeyLease:
+    """Key prestada a una solicitud mientras dura el bloque `with`."""
+
+    def __init__(self, state):
+        self._state = state
+
+    @property
+    def alias(self):
+        return self._state.alias
+
+    def generative_client(self):
+        return self._state.client("generative")
+
+    def file_client(self):
+        return self._state.client("file")
+
+    def cache_client(self):
+        return self._state.client("cache")
+
+
+class ApiKeyPool:
+    def __init__(
+        self,
+        api_keys,
+        requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE,
+        burst=DEFAULT_BURST,
+        acquire_timeout=30.0,
+        client_config=None,
+    ):
+        """
+        `client_config` se pasa a la configuración de los clientes de cada
+        key (por ejemplo `transport` y `client_options` para apuntar a otro
+        endpoint).
+        """
+        if not api_keys:
+            raise ValueError("Se necesita al menos una API key de Gemini")
+        self.acquire_timeout = acquire_timeout
+        self._states = [
+            ApiKeyState(alias, key, requests_per_minute, burst, client_config)
+            for alias, key in api_keys.items()
+        ]
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        return len(self._states)
+
+    @contextmanager
+    def lease(self, exclude=(), prefer=None, only=None, timeout=None):
+        """
+        Presta una key durante el bloque `with`.
+
+        Una excepción dentro del bloque se registra contra la key según
+        `classify_error` y se vuelve a lanzar. `exclude` evita las keys ya
+        probadas en un reintento; `prefer` pide una key concreta si está
+        disponible y `only` exige una (por ejemplo la que subió un archivo,
+        que no es visible desde los proyectos de las demás keys).
+        """
+        state = self._acquire(
+            set(exclude), prefer, only, self.acquire_timeout if timeout is None else timeout
+        )
+        try:
+            yield KeyLease(state)
+        except Exception as exc:
+            self._release(state, exc)
+            raise
+        except BaseException:
+            self._release(state, None)
+            raise
+        else:
+            self._release(state, None)
+
+    def saturated(self):
+        """True si ninguna key puede atender una solicitud ahora mismo."""
+        now = time.monotonic()
+        with self._condition:
+            return not any(
+                s.cooldown_until <= now and s.bucket.available(now) >= 1.0 for s in self._states
+            )
+
+    def snapshot(self):
+        """Estado de cada key, sin exponer la key misma."""
+        now = time.monotonic()
+        with self._condition:
+            return [
+                {
+                    "alias": s.alias,
+                    "in_flight": s.in_flight,
+                    "tokens": round(s.bucket.available(now), 2),
+                    "cooldown_seconds": round(max(0.0, s.cooldown_until - now), 1),
+                    "successes": s.successes,
+                    "failures": s.failures,
+                    "last_error": s.last_error,
+                }
+                for s in self._states
+            ]
+
+    def _acquire(self, exclude, prefer, only, timeout):
+        states = [s for s in self._states if only is None or s.alias == only]
+        if not states:
+            raise NoApiKeyAvailable(f"No existe la API key {only}")
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                healthy = [s for s in states if s.cooldown_until <= now]
+                candidates = [s for s in healthy if s.alias not in exclude] or healthy
+                ready = [s for s in candidates if s.bucket.available(now) >= 1.0]
+                if ready:
+                    preferred = [s for s in ready if s.alias == prefer]
+                    state = preferred[0] if preferred else min(
+                        ready, key=lambda s: (s.in_flight, -s.bucket.tokens)
+                    )
+                    state.bucket.take(now)
+                    state.in_flight += 1
+                    return state
+
+                if candidates:
+                    wait = min(s.bucket.seconds_until_token(now) for s in candidates)
+                else:
+                    wait = min(s.cooldown_until for s in states) - now
+                remaining = deadline - now
+                if remaining <= 0:
+                    raise NoApiKeyAvailable("Todas las API keys de Gemini están ocupadas o en enfriamiento")
+                self._condition.wait(min(max(wait, 0.01), remaining))
+
+    def _release(self, state, exc):
+        with self._condition:
+            state.in_flight -= 1
+            if exc is None:
+                state.successes += 1
+                state.consecutive_failures = 0
+            else:
+                kind = classify_error(exc)
+                if kind != ERROR_REQUEST:
+                    state.failures += 1
+                    state.consecutive_failures += 1
+                    state.last_error = type(exc).__name__
+                    self._penalize(state, kind)
+            self._condition.notify_all()
+
+    def _penalize(self, state, kind):
+        now = time.monotonic()
+        if kind == ERROR_AUTH:
+            cooldown = MAX_COOLDOWN_SECONDS
+        elif kind == ERROR_RATE_LIMIT:
+            cooldown = BASE_COOLDOWN_SECONDS * 2 ** (state.consecutive_failures - 1)
+        elif state.consecutive_failures >= TRANSIENT_FAILURE_LIMIT:
+            cooldown = BASE_COOLDOWN_SECONDS
+        else:
+            return
+        state.cooldown_until = now + min(cooldown, MAX_COOLDOWN_SECONDS)
@@ -0,0 +1,234 @@
+"""
+Métricas de latencia por etapa y contadores, en formato de texto de Prometheus.
+
+Cada etapa de una evaluación (escritura del video, subida, activación,
+generación, guardado, ...) se mide con `span`, que alimenta un histograma
+del proceso y, si se pasa un `RequestTrace`, los tiempos de esa solicitud
+para guardarlos junto con la consulta. El registro es único por proceso, así
+que también lo usan los hilos de fondo.
+
+`render` produce el texto que sirve `serve` en http://host:puerto/metrics o
+que `export_to_file` escribe periódicamente en un archivo.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+STAGE_HISTOGRAM = "petscan_stage_duration_seconds"
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    partes = []
+    for nombre, valor in labels:
+        valor = str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        partes.append(f'{nombre}="{valor}"')
+    return "{" + ",".join(partes) + "}"
+
+
+class Metrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, help="", **labels):
+        clave = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            self._counters[clave] = self._counters.get(clave, 0) + amount
+
+    def observe(self, name, value, help="", **labels):
+        clave = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            histograma = self._histograms.get(clave)
+            if histograma is None:
+                histograma = self._histograms[clave] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if value <= limite:
+                    histograma[0][i] += 1
+            histograma[1] += value
+            histograma[2] += 1
+
+    def snapshot(self):
+        """Copia serializable de los contadores e histogramas, para `merge`."""
+        with self._lock:
+            return {
+                "help": dict(self._help),
+                "counters": dict(self._counters),
+                "histograms": {
+                    clave: (list(conteos), suma, total)
+                    for clave, (conteos, suma, total) in self._histograms.items()
+                },
+            }
+
+    def merge(self, snapshot):
+        """Suma un `snapshot` de otro proceso con los mismos buckets."""
+        with self._lock:
+            for name, ayuda in snapshot["help"].items():
+                self._help.setdefault(name, ayuda)
+            for clave, valor in snapshot["counters"].items():
+                self._counters[clave] = self._counters.get(clave, 0) + valor
+            for clave, (conteos, suma, total) in snapshot["histograms"].items():
+                histograma = self._histograms.setdefault(clave, [[0] * len(self.buckets), 0.0, 0])
+                histograma[0] = [a + b for a, b in zip(histograma[0], conteos)]
+                histograma[1] += suma
+                histograma[2] += total
+
+    def value(self, name, **labels):
+        """Valor actual de un contador, o la suma de todas sus etiquetas si no se dan."""
+        with self._lock:
+            if labels:
+                return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+            return sum(valor for (nombre, _), valor in self._counters.items() if nombre == name)
+
+    def quantile(self, name, q, **labels):
+        """
+        Estimación del cuantil `q` de un histograma, interpolando dentro del
+        bucket como lo hace histogram_quantile de Prometheus. None si no hay
+        observaciones.
+        """
+        with self._lock:
+            histograma = self._histograms.get((name, tuple(sorted(labels.items()))))
+            if histograma is None or not histograma[2]:
+                return None
+            conteos, total = list(histograma[0]), histograma[2]
+        objetivo = q * total
+        anterior_limite, anterior_conteo = 0.0, 0
+        for limite, conteo in zip(self.buckets, conteos):
+            if conteo >= objetivo:
+                fraccion = (objetivo - anterior_conteo) / max(conteo - anterior_conteo, 1)
+                return anterior_limite + (limite - anterior_limite) * fraccion
+            anterior_limite, anterior_conteo = limite, conteo
+        return self.buckets[-1]
+
+    def render(self):
+        """Texto en el formato de exposición de Prometheus (versión 0.0.4)."""
+        with self._lock:
+            lineas = []
+            for name in sorted(self._help):
+                tipo, ayuda = self._help[name]
+                if ayuda:
+                    lineas.append(f"# HELP {name} {ayuda}")
+                lineas.append(f"# TYPE {name} {tipo}")
+                if tipo == "counter":
+                    for (nombre, labels), valor in sorted(self._counters.items()):
+                        if nombre == name:
+                            lineas.append(f"{name}{_format_labels(labels)} {valor}")
+                    continue
+                for (nombre, labels), (conteos, suma, total) in sorted(self._histograms.items()):
+                    if nombre != name:
+                        continue
+                    for limite, conteo in zip(self.buckets, conteos):
+                        lineas.append(f"{name}_bucket{_format_labels(labels + (('le', limite),))} {conteo}")
+                    lineas.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {total}")
+                    lineas.append(f"{name}_sum{_format_labels(labels)} {suma}")
+                    lineas.append(f"{name}_count{_format_labels(labels)} {total}")
+            return "\n".join(lineas) + "\n"
+
+
+REGISTRY = Metrics()
+
+
+def inc(name, amount=1, help="", **labels):
+    REGISTRY.inc(name, amount, help, **labels)
+
+
+@contextmanager
+def span(stage, trace=None):
+    """
+    Mide la duración del bloque como la etapa `stage`. Si el bloque lanza
+    una excepción se cuenta en `petscan_errors_total`.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        inc("petscan_errors_total", help="Errores por etapa.", stage=stage)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        REGISTRY.observe(STAGE_HISTOGRAM, duracion, help="Duración de cada etapa de la evaluación.", stage=stage)
+        if trace is not None:
+            trace.record(stage, duracion)
+
+
+class RequestTrace:
+    """Tiempos y atributos de una evaluación, para guardarlos con la consulta."""
+
+    def __init__(self):
+        self.timings = {}
+        self.attributes = {}
+        self._inicio = time.perf_counter()
+
+    def record(self, stage, seconds):
+        self.timings[stage] = round(self.timings.get(stage, 0.0) + seconds, 4)
+
+    def span(self, stage):
+        return span(stage, self)
+
+    def as_dict(self):
+        return {**self.timings, "total": round(time.perf_counter() - self._inicio, 4)}
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        cuerpo = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host="127.0.0.1", port=9464, registry=REGISTRY):
+    """
+    Sirve /metrics en un hilo de fondo y retorna el servidor. Lanza OSError
+    si el puerto ya está ocupado (por ejemplo, por otro proceso de la app).
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
+
+
+def write_file(path, registry=REGISTRY):
+    """Escribe las métricas en `path` de forma atómica."""
+    temporal = f"{path}.tmp"
+    with open(temporal, "w", encoding="utf-8") as archivo:
+        archivo.write(registry.render())
+    os.replace(temporal, path)
+
+
+def export_to_file(path, interval=15.0, registry=REGISTRY):
+    """
+    Reescribe `path` cada `interval` segundos en un hilo de fondo, para
+    recolectores que leen archivos (por ejemplo el textfile de node_exporter).
+    """
+    def loop():
+        while True:
+            try:
+                write_file(path, registry)
+            except OSError:
+                pass
+            time.sleep(interval)
+
+    hilo = threading.Thread(target=loop, name="metrics-file", daemon=True)
+    hilo.start()
+    return hilo
@@ -0,0 +1,482 @@
+"""
+Cuestionario declarativo: preguntas, condiciones por especie y traducciones.
+
+La interfaz de APP.py y el prompt para Gemini se generan a partir de este
+esquema, así que agregar un idioma o una pregunta es agregar datos aquí. Las
+traducciones son diccionarios `{código de idioma: texto}`.
+
+Solo las preguntas con `prompt_label` llegan al modelo; los datos del dueño
+se guardan en Supabase pero nunca forman parte del prompt.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+
+# Nombre que se muestra en el selector de idioma -> código interno
+LANGUAGES = {"Español": "es", "English": "en"}
+
+CAT = "cat"
+DOG = "dog"
+
+# Máximo de tokens del prompt; por encima se omiten las secciones opcionales
+PROMPT_TOKEN_BUDGET = 1024
+# Estimación para la parte variable del prompt, que no se mide con la API
+CHARS_PER_TOKEN = 4
+
+
+@dataclass(frozen=True)
+class Question:
+    field: str
+    label: dict
+    widget: str = "radio"
+    options: tuple = ()
+    species: str = None
+    # Etiqueta en el prompt; None deja la pregunta fuera de la entrada del modelo
+    prompt_label: dict = None
+    # Índice de la opción que muestra `warning` al seleccionarse
+    warn_on: int = None
+    warning: dict = None
+    min_value: int = 0
+    max_value: int = 50
+    default: int = 0
+    # Texto e imágenes `(ruta, {idioma: pie})` que se muestran antes de la pregunta
+    intro: dict = None
+    images: tuple = ()
+
+    def option_labels(self, lang):
+        return [opcion[lang] for opcion in self.options]
+
+
+YES_NO = ({"en": "Yes", "es": "Sí"}, {"en": "No", "es": "No"})
+
+SPECIES_OPTIONS = {CAT: {"en": "Cat", "es": "Gato"}, DOG: {"en": "Dog", "es": "Perro"}}
+
+OWNER_QUESTIONS = (
+    Question("owner_country", {"en": "Country", "es": "País"}, widget="text"),
+    Question("owner_name", {"en": "Owner's Name", "es": "Nombre del dueño"}, widget="text"),
+    Question(
+        "owner_contact",
+        {"en": "Contact Number (with country code)", "es": "Número de contacto (con indicativo del país)"},
+        widget="text",
+    ),
+    Question("owner_email", {"en": "Email", "es": "Email"}, widget="text"),
+)
+
+SPECIES_QUESTION = Question(
+    "tipo_animal",
+    {"en": "What type of animal is it?", "es": "¿Qué tipo de animal es?"},
+    options=(SPECIES_OPTIONS[CAT], SPECIES_OPTIONS[DOG]),
+)
+
+GENERAL_QUESTIONS = (
+    Question(
+        "comida",
+        {"en": "Is the animal eating and drinking?", "es": "¿Está comiendo y tomando agua?"},
+        options=YES_NO,
+        prompt_label={"en": "Eating and drinking", "es": "Comiendo y bebiendo"},
+    ),
+    Question(
+        "eliminacion",
+        {"en": "Is it eliminating normally?", "es": "¿Está orinando y defecando normalmente?"},
+        options=YES_NO,
+        prompt_label={"en": "Normal elimination", "es": "Eliminación normal"},
+    ),
+    Question(
+        "edad",
+        {"en": "How old is the animal?", "es": "¿Qué edad tiene el animal?"},
+        widget="number",
+        default=3,
+        prompt_label={"en": "Age", "es": "Edad"},
+    ),
+    Question(
+        "acicala",
+        {"en": "Is it grooming itself properly?", "es": "¿Se acicala correctamente?"},
+        options=YES_NO,
+        prompt_label={"en": "Grooming", "es": "Acicalamiento"},
+    ),
+)
+
+DIARRHEA_QUESTION = Question(
+    "diarrhea_vomiting",
+    {"en": "Has the animal experienced diarrhea or vomiting?", "es": "¿El animal ha tenido diarrea o vómito?"},
+    options=YES_NO,
+    prompt_label={"en": "Diarrhea or vomiting", "es": "Diarrea o vómito"},
+    warn_on=0,
+    warning={
+        "en": "Warning: It is highly recommended to consult a veterinarian immediately.",
+        "es": "Advertencia: Es altamente recomendable consultar a un veterinario inmediatamente.",
+    },
+)
+
+SPECIES_QUESTIONS = (
+    Question(
+        "grooming_regular",
+        {"en": "Does the cat groom itself regularly?", "es": "¿El gato se acicala regularmente?"},
+        options=YES_NO,
+        species=CAT,
+        prompt_label={"en": "Regular grooming", "es": "Se acicala regularmente"},
+    ),
+    Question(
+        "cambios_grooming",
+        {"en": "Have there been any changes in its grooming habits?", "es": "¿Ha habido algún cambio en sus hábitos de acicalamiento?"},
+        options=YES_NO,
+        species=CAT,
+        prompt_label={"en": "Changes in grooming", "es": "Cambios en el acicalamiento"},
+    ),
+    Question(
+        "cambios_aseo",
+        {"en": "Is your dog scratching more than usual?", "es": "¿Se rasca más de lo común?"},
+        options=YES_NO,
+        species=DOG,
+        prompt_label={"en": "Changes in grooming habits", "es": "Cambios en hábitos de aseo"},
+    ),
+    Question(
+        "comportamiento_cambio",
+        {"en": "Has the cat's behavior changed recently?", "es": "¿Ha cambiado recientemente el comportamiento del gato?"},
+        options=YES_NO,
+        species=CAT,
+        prompt_label={"en": "Change in behavior", "es": "Cambio en comportamiento"},
+    ),
+    Question(
+        "comportamiento_cambio",
+        {"en": "Has the dog's behavior changed recently?", "es": "¿Ha cambiado recientemente el comportamiento del perro?"},
+        options=YES_NO,
+        species=DOG,
+        prompt_label={"en": "Change in behavior", "es": "Cambio en comportamiento"},
+    ),
+    Question(
+        "sociable",
+        {"en": "Is the cat sociable or shy?", "es": "¿El gato es sociable o tímido?"},
+        options=({"en": "Sociable", "es": "Sociable"}, {"en": "Shy", "es": "Tímido"}),
+        species=CAT,
+        prompt_label={"en": "Sociability", "es": "Sociabilidad"},
+    ),
+    Question(
+        "sociable",
+        {"en": "Is the dog sociable or does it show shyness/aggressiveness?", "es": "¿El perro es sociable o muestra timidez/agresividad?"},
+        options=({"en": "Sociable", "es": "Sociable"}, {"en": "Shy/Aggressive", "es": "Tímido/Agresivo"}),
+        species=DOG,
+        prompt_label={"en": "Sociability", "es": "Sociabilidad"},
+    ),
+    Question(
+        "ocultarse",
+        {"en": "Does the cat hide or avoid interaction?", "es": "¿El gato se esconde o evita interactuar?"},
+        options=YES_NO,
+        species=CAT,
+        prompt_label={"en": "Hiding", "es": "Se esconde"},
+    ),
+    Question(
+        "ocultarse",
+        {"en": "Does the dog hide or avoid interaction?", "es": "¿El perro se esconde o evita interactuar?"},
+        options=YES_NO,
+        species=DOG,
+        prompt_label={"en": "Hiding", "es": "Se esconde"},
+    ),
+    Question(
+        "reacio",
+        {
+            "en": "Does the cat seem reluctant to go out even to see its favorite person or get its food?",
+            "es": "¿El gato se muestra reacio a salir incluso para ver a su persona favorita o recibir su comida?",
+        },
+        options=YES_NO,
+        species=CAT,
+        prompt_label={"en": "Reluctance to go out", "es": "Reacio a salir"},
+    ),
+    Question(
+        "reacio",
+        {
+            "en": "Does the dog seem reluctant to go out even to interact with its owner or receive food?",
+            "es": "¿El perro se muestra reacio a salir incluso para interactuar con su dueño o recibir su comida?",
+        },
+        options=YES_NO,
+        species=DOG,
+        prompt_label={"en": "Reluctance to go out", "es": "Reacio a salir"},
+    ),
+    Question(
+        "imagen_estado",
+        {
+            "en": "Select the image that best represents your cat's condition:",
+            "es": "Seleccione la imagen que más se parezca al estado de su gato:",
+        },
+        options=(
+            {"en": "Normal condition", "es": "Estado normal"},
+            {"en": "Condition with pain", "es": "Estado con dolor"},
+        ),
+        species=CAT,
+        prompt_label={"en": "Image representing overall condition", "es": "Imagen que representa el estado general"},
+        intro={
+            "en": "Which of these images most closely resembles your cat's overall condition recently?",
+            "es": "¿Cuál de estas imágenes se parece más al estado general de su gato en el último tiempo?",
+        },
+        images=(
+            ("gato_normal.png", {
+                "en": "Normal condition (Ears up, mouth closed, eyes open, relaxed whiskers)",
+                "es": "Estado normal (Orejas arriba, boca cerrada, ojos abiertos, Bigotes relajados)",
+            }),
+            ("gato_dolor.png", {
+                "en": "Condition with pain (Eyes closed, ears down, mouth open, bristled whiskers)",
+                "es": "Estado con dolor (Ojos cerrados, orejas caídas, boca abierta, Bigotes erizados)",
+            }),
+        ),
+    ),
+)
+
+TEXTS = {
+    "title": {"en": "Preventive pet health assessment", "es": "Evaluación Inicial de Salud de Mascotas"},
+    "intro": {
+        "en": """
+        **Welcome!**  
+        This application uses artificial intelligence to provide an initial evaluation of your pet's health.  
+
+        **How to use this application:**  
+        1. **Select your language.**  
+        2. **Enter your owner information:** Country, Owner's Name, Contact Number (with country code), and Email.  
+        3. **Provide general information** about your pet, including its type, eating habits, elimination, age, and grooming.  
+        4. **Answer additional questions** specific to your pet type (Cat or Dog).  
+        5. **Indicate if your pet has experienced diarrhea or vomiting.**  
+           - If yes, a warning will appear urging you to consult a veterinarian immediately.  
+        6. **Optionally, upload a video** of your pet.  
+        7. Click the **Evaluate** button to receive a detailed, empathetic analysis with clear recommendations.
+
+        **Note:** This is an initial assessment provided by an AI, which may not be entirely accurate. If in doubt, please consult a veterinarian.
+        """,
+        "es": """
+        **¡Bienvenido!**  
+        Esta aplicación utiliza inteligencia artificial para ofrecer una evaluación inicial de la salud de su mascota.  
+
+        **Cómo usar esta aplicación:**  
+        1. **Seleccione el idioma.**  
+        2. **Ingrese la información del dueño:** País, Nombre del dueño, Número de contacto (con indicativo del país) y Email.  
+        3. **Proporcione información general** sobre su mascota, incluyendo tipo, hábitos alimenticios, eliminación, edad y acicalamiento.  
+        4. **Responda las preguntas adicionales** específicas según el tipo de animal (Gato o Perro).  
+        5. **Indique si el animal ha tenido diarrea o vómito.**  
+           - Si responde que sí, se mostrará una advertencia para que consulte a un veterinario de inmediato.  
+        6. **Opcionalmente, suba un video** de su mascota.  
+        7. Presione el botón **Evaluar** para recibir un análisis detallado y empático del estado de su mascota con recomendaciones claras.
+
+        **Nota:** Esta es una evaluación inicial proporcionada por una IA, la cual puede no ser completamente precisa. Ante cualquier duda, consulte a un veterinario.
+        """,
+    },
+    "owner_header": {"en": "Owner Information", "es": "Información del Dueño"},
+    "species_header": {
+        CAT: {"en": "Additional Questions for Cats", "es": "Preguntas adicionales para gatos"},
+        DOG: {"en": "Additional Questions for Dogs", "es": "Preguntas adicionales para perros"},
+    },
+    "video": {"en": "Upload a video of the pet (optional)", "es": "Sube un video del animal (opcional)"},
+    "button": {"en": "Evaluate", "es": "Evaluar"},
+    "response_header": {"en": "AI Response:", "es": "Respuesta de la IA:"},
+    "triage_header": {"en": "Initial triage:", "es": "Triaje inicial:"},
+    "triage_reasons": {"en": "Based on", "es": "Según"},
+    "llm_skipped": {
+        "en": "Routine case: no detailed analysis was generated.",
+        "es": "Caso de rutina: no se generó un análisis detallado.",
+    },
+    "video_processing": {"en": "Waiting for the file to be processed...", "es": "Esperando a que el archivo se procese..."},
+    "video_active": {"en": "The file is now active.", "es": "El archivo ya está activo."},
+    "video_error": {"en": "Error uploading or processing the video: {error}", "es": "Error al subir o procesar el video: {error}"},
+    "video_failed": {
+        "en": "The video upload failed ({error}); it will be retried when you press the button below.",
+        "es": "La subida del video falló ({error}); se volverá a intentar al presionar el botón de abajo.",
+    },
+    "saved": {
+        "en": "Assessment recorded; it will be saved to the database in the background.",
+        "es": "Consulta registrada; se guardará en la base de datos Supabase en segundo plano.",
+    },
+    "save_failed": {
+        "en": "The assessment could not be saved right now. Please try again in a few minutes.",
+        "es": "No se pudo guardar la consulta en este momento. Intente de nuevo en unos minutos.",
+    },
+}
+
+PROMPT_TEXTS = {
+    "heading": {"en": "Pet Health Evaluation for a {tipo_animal}.", "es": "Evaluación de salud para un {tipo_animal}."},
+    "species_heading": {
+        CAT: {"en": "Additional questions for cats:", "es": "Preguntas específicas para gatos:"},
+        DOG: {"en": "Additional questions for dogs:", "es": "Preguntas específicas para perros:"},
+    },
+    "criteria": {
+        "en": (
+            "Evaluation criteria:\n"
+            "Eyes: Are the eyes half-closed or narrowed? Is there any wrinkling around the eyes?\n"
+            "Nose and Cheeks: Is the bridge of the nose flattened or elongated? Are the cheeks flattened or appear sunken?\n"
+            "Ears: Are the ears turned inward and forward, creating a pointed shape? Has the space between the ears increased?\n"
+            "Whiskers: Are the whiskers stiff and held close to the face? Are the whiskers clumped together? Have the whiskers lost their natural downward curve?\n"
+            "Additional Considerations: Pain Assessment using a validated scale (e.g., Feline Grimace Scale for cats) and species-specific features.\n\n"
+        ),
+        "es": (
+            "Criterios para evaluar la información:\n"
+            "Eyes: ¿Los ojos están entrecerrados o se ven estrechos? ¿Hay algún fruncimiento alrededor de los ojos?\n"
+            "Nose and Cheeks: ¿El puente de la nariz está aplanado o alargado? ¿Las mejillas están aplanadas o se ven hundidas?\n"
+            "Ears: ¿Las orejas están giradas hacia adentro y hacia adelante, creando una forma puntiaguda? ¿Ha aumentado el espacio entre las orejas?\n"
+            "Whiskers: ¿Los bigotes están rígidos y pegados a la cara? ¿Los bigotes se ven aglomerados? ¿Han perdido los bigotes su curva natural hacia abajo?\n"
+            "Consideraciones adicionales: Evaluación del dolor usando una escala validada (por ejemplo, Feline Grimace Scale para gatos) y características específicas de la especie.\n\n"
+        ),
+    },
+    "video": {"en": "Uploaded video: {video_uri}\n\n", "es": "Video cargado: {video_uri}\n\n"},
+    "instructions": {
+        "en": (
+            "Please analyze all the provided information accurately, but respond in a kind and approachable manner. "
+            "Explain what is observed and provide clear recommendations on actions to take, using an empathetic and understanding tone. "
+            "The response should be detailed and deep, without losing precision in the analysis.\n"
+        ),
+        "es": (
+            "Por favor, analiza toda la información proporcionada de forma precisa, pero respondiendo de manera amable y cercana. "
+            "Explique lo que se observa y brinde recomendaciones claras sobre qué acciones tomar, en un tono empático y comprensivo. "
+            "La respuesta debe ser detallada y profunda, sin perder la precisión en el análisis.\n"
+        ),
+    },
+    # Opcional: se omite primero si el prompt supera el presupuesto de tokens
+    "note": {
+        "en": "\n**Note:** This information is analyzed by an AI, which may be incorrect. In case of any doubt, please consult a veterinarian.",
+        "es": "\n**Nota:** Esta información es analizada por una IA, la cual puede equivocarse. Ante cualquier duda, consulte a un veterinario.",
+    },
+}
+
+
+def text(key, lang):
+    return TEXTS[key][lang]
+
+
+def species_code(tipo_animal):
+    """Código de especie a partir de la opción mostrada en cualquier idioma."""
+    for code, etiquetas in SPECIES_OPTIONS.items():
+        if tipo_animal in etiquetas.values():
+            return code
+    raise ValueError(f"Tipo de animal desconocido: {tipo_animal}")
+
+
+def species_questions(species):
+    return [q for q in SPECIES_QUESTIONS if q.species == species]
+
+
+def _escape(fragment):
+    return fragment.replace("{", "{{").replace("}", "}}")
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    """
+    Plantilla ya armada para un idioma y una especie: `answers` tiene un
+    campo `{nombre}` por respuesta, `video` uno `{video_uri}` y el resto de
+    las secciones es texto fijo.
+    """
+    lang: str
+    species: str
+    answers: str
+    criteria: str
+    video: str
+    instructions: str
+    note: str
+
+    @property
+    def static_text(self):
+        """Prefijo fijo del prompt: criterios, instrucciones y nota."""
+        return self.criteria + self.instructions + self.note
+
+
+@lru_cache(maxsize=None)
+def compile_prompt(lang, species):
+    lineas = [PROMPT_TEXTS["heading"][lang]]
+    for q in GENERAL_QUESTIONS:
+        lineas.append(f"- {_escape(q.prompt_label[lang])}: {{{q.field}}}")
+    lineas[-1] += "\n"
+    lineas.append(_escape(PROMPT_TEXTS["species_heading"][species][lang]))
+    for q in species_questions(species):
+        if q.prompt_label is not None:
+            lineas.append(f"- {_escape(q.prompt_label[lang])}: {{{q.field}}}")
+    lineas[-1] += "\n"
+    lineas.append(f"- {_escape(DIARRHEA_QUESTION.prompt_label[lang])}: {{{DIARRHEA_QUESTION.field}}}\n\n")
+    return CompiledPrompt(
+        lang=lang,
+        species=species,
+        answers="\n".join(lineas),
+        criteria=PROMPT_TEXTS["criteria"][lang],
+        video=PROMPT_TEXTS["video"][lang],
+        instructions=PROMPT_TEXTS["instructions"][lang],
+        note=PROMPT_TEXTS["note"][lang],
+    )
+
+
+class PromptBuilder:
+    """
+    Arma prompts a partir de las plantillas compiladas y hace cumplir
+    `budget` tokens.
+
+    La parte fija de cada plantilla se mide con `count_tokens` de la API en
+    un hilo de fondo (`start_measuring`), nunca al armar un prompt: medir
+    ocupa una solicitud del pool de keys y puede esperar a que haya cuota.
+    Mientras no hay medición, y para la parte variable (respuestas cortas),
+    se estima por caracteres.
+    """
+
+    # Espera entre rondas de medición cuando alguna plantilla no se pudo medir
+    RETRY_SECONDS = 60
+    MAX_ROUNDS = 5
+
+    def __init__(self, budget=PROMPT_TOKEN_BUDGET):
+        self.budget = budget
+        self._static_tokens = {}
+        self._lock = threading.Lock()
+
+    def static_tokens(self, compiled):
+        with self._lock:
+            tokens = self._static_tokens.get((compiled.lang, compiled.species))
+        if tokens is None:
+            return len(compiled.static_text) // CHARS_PER_TOKEN
+        return tokens
+
+    def measure_static_tokens(self, count_tokens):
+        """
+        Mide las plantillas de cada idioma y especie que aún no tienen
+        medición; retorna cuántas quedan sin medir.
+        """
+        faltan = 0
+        for lang in LANGUAGES.values():
+            for species in SPECIES_OPTIONS:
+                with self._lock:
+                    if (lang, species) in self._static_tokens:
+                        continue
+                try:
+                    tokens = count_tokens(compile_prompt(lang, species).static_text)
+                except Exception:
+                    faltan += 1
+                    continue
+                with self._lock:
+                    self._static_tokens[(lang, species)] = tokens
+        return faltan
+
+    def start_measuring(self, count_tokens):
+        """Mide las plantillas en un hilo de fondo, con reintentos."""
+        def medir():
+            for _ in range(self.MAX_ROUNDS):
+                if not self.measure_static_tokens(count_tokens):
+                    return
+                time.sleep(self.RETRY_SECONDS)
+
+        hilo = threading.Thread(target=medir, name="prompt-tokens", daemon=True)
+        hilo.start()
+        return hilo
+
+    def static_prefix(self, lang, answers):
+        """Prefijo fijo con el que empieza el prompt de `answers`."""
+        return compile_prompt(lang, species_code(answers["tipo_animal"])).static_text + "\n\n"
+
+    def build(self, lang, answers, video_uri=None):
+        """
+        Retorna el prompt para `answers` (campo -> opción mostrada). La parte
+        fija va primero, para que sea un prefijo común que se pueda cachear, y
+        después las respuestas. La nota es opcional y se omite si el prompt
+        excede el presupuesto.
+        """
+        compiled = compile_prompt(lang, species_code(answers["tipo_animal"]))
+        respuestas = compiled.answers.format_map(answers)
+        video = compiled.video.format(video_uri=video_uri) if video_uri else ""
+        tokens = self.static_tokens(compiled) + (len(respuestas) + len(video)) // CHARS_PER_TOKEN
+        nota = compiled.note
+        if tokens > self.budget:
+            tokens -= len(nota) // CHARS_PER_TOKEN
+            nota = ""
+        if tokens > self.budget:
+            raise ValueError(f"El prompt supera el presupuesto de {self.budget} tokens")
+        return compiled.criteria + compiled.instructions + nota + "\n\n" + respuestas + video
@@ -0,0 +1,137 @@
+"""
+Caché de respuestas de la IA para cuestionarios con las mismas respuestas.
+
+Muchos cuestionarios sin video comparten exactamente las mismas respuestas
+clínicas; para ellos se reutiliza la respuesta ya generada en lugar de pagar
+otra llamada a Gemini. La clave es un hash de la forma canónica de esas
+respuestas: los datos del dueño nunca forman parte de ella.
+
+Hay dos niveles: un LRU en memoria y, detrás, una base SQLite local que
+sobrevive a los reinicios. Ambos descartan entradas por antigüedad (TTL) y
+por tamaño.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+MEMORY_MAX_ENTRIES = 1024
+DISK_MAX_ENTRIES = 50_000
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "petscan-responses.sqlite3")
+
+# Datos personales que nunca deben influir en la clave
+PII_FIELDS = frozenset({"owner_name", "owner_contact", "owner_email", "owner_country"})
+
+
+def response_cache_key(answers, language, model_name, prompt_version):
+    """
+    Hash de la forma canónica de las respuestas: sin datos del dueño, con
+    los textos normalizados y las claves ordenadas.
+    """
+    canonical = {
+        campo: valor.strip().casefold() if isinstance(valor, str) else valor
+        for campo, valor in answers.items()
+        if campo not in PII_FIELDS
+    }
+    payload = json.dumps(
+        {"answers": canonical, "language": language, "model": model_name, "prompt": prompt_version},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path=DEFAULT_PATH,
+        ttl=DEFAULT_TTL_SECONDS,
+        memory_max_entries=MEMORY_MAX_ENTRIES,
+        disk_max_entries=DISK_MAX_ENTRIES,
+    ):
+        self.ttl = ttl
+        self.memory_max_entries = memory_max_entries
+        self.disk_max_entries = disk_max_entries
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, created = entry
+                if now - created < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits_memory += 1
+                    return value
+                del self._memory[key]
+
+            row = self._db.execute(
+                "SELECT value, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._remember(key, row[0], row[1])
+            self.hits_disk += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, value, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self.stores += 1
+            self._evict_disk(now)
+
+    def stats(self):
+        with self._lock:
+            consultas = self.hits_memory + self.hits_disk + self.misses
+            return {
+                "hits_memory": self.hits_memory,
+                "hits_disk": self.hits_disk,
+                "misses": self.misses,
+                "stores": self.stores,
+                "hit_ratio": (self.hits_memory + self.hits_disk) / consultas if consultas else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+    def _remember(self, key, value, created):
+        self._memory[key] = (value, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_max_entries:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self, now):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        sobrantes = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0] - self.disk_max_entries
+        if sobrantes > 0:
+            self._db.execute(
+                "DELETE FROM responses WHERE key IN"
+                " (SELECT key FROM responses ORDER BY accessed LIMIT ?)",
+                (sobrantes,),
+            )
@@ -0,0 +1,324 @@
+"""
+Escritura en segundo plano de las consultas en Supabase.
+
+Guardar la consulta ya no bloquea la página: `submit` agrega la fila a una
+cola local en SQLite (que sobrevive a caídas y reinicios) y un hilo de fondo
+la envía a Supabase en inserts por lotes, al juntar `batch_size` filas o al
+pasar `flush_interval` segundos. Si Supabase no responde, las filas quedan en
+la cola y se reintentan con espera exponencial. Si la cola crece por encima
+de `max_pending`, `submit` rechaza filas nuevas en lugar de llenar el disco.
+
+Las filas que Supabase rechaza (por ejemplo, por una columna que no existe)
+pasan a la tabla `dead_letter` de la misma cola; después de corregir el
+esquema se devuelven a la cola con:
+
+    python supabase_writer.py --queue /tmp/petscan-supabase-queue.sqlite3
+"""
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import metrics
+
+DEFAULT_PATH = os.path.join(tempfile.gettempdir(), "petscan-supabase-queue.sqlite3")
+BATCH_SIZE = 50
+FLUSH_INTERVAL_SECONDS = 2.0
+MAX_PENDING = 10_000
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 5 * 60
+# Intentos antes de mover una fila rechazada por Supabase a `dead_letter`
+MAX_ATTEMPTS = 5
+# Códigos de PostgREST y de Postgres que indican que el servicio o la base no
+# estaban disponibles, no que la fila sea inválida: PGRST000-PGRST003 (sin
+# conexión a la base), 08 (conexión), 53 (recursos), 57P (base reiniciándose)
+# y 40001/40P01 (conflictos de concurrencia)
+TRANSIENT_CODE_PREFIXES = ("PGRST000", "PGRST001", "PGRST002", "PGRST003", "08", "53", "57P", "40001", "40P01")
+
+
+def response_row(language, owner, answers, prompt, ai_response, triage_result, trace, video_uri=None):
+    """
+    Fila de la tabla "responses" para una evaluación, la misma desde la app
+    y desde batch.py. `ai_response` es None si el triaje omitió a Gemini.
+    """
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "language": language,
+        **owner,
+        **answers,
+        "video_uri": video_uri if video_uri is not None else "",
+        "prompt": prompt,
+        "ai_response": ai_response,
+        **triage_result.as_row(),
+        "api_key": trace.attributes.get("api_key", ""),
+        "model": trace.attributes.get("model", ""),
+        "timings": trace.as_dict(),
+    }
+
+
+class WriterOverloaded(Exception):
+    """La cola local llegó a su límite; la fila no se aceptó."""
+
+
+def is_transient_error(exc):
+    """
+    Decide si un error de Supabase se debe a que el servicio no estaba
+    disponible (red, 5xx, 429) y no a la fila. PostgREST entrega los 5xx y
+    429 como `APIError`: con el código HTTP si la respuesta no era JSON (una
+    página de error del gateway) y sin código si lo era pero no venía de
+    PostgREST.
+    """
+    from httpx import TransportError
+    from postgrest.exceptions import APIError
+
+    if isinstance(exc, TransportError):
+        return True
+    if not isinstance(exc, APIError):
+        return False
+    code = str(exc.code or "")
+    if code.isdigit():
+        return int(code) in (408, 429) or int(code) >= 500
+    return not code or code.startswith(TRANSIENT_CODE_PREFIXES)
+
+
+class SupabaseWriter:
+    """
+    `connect` crea el cliente de Supabase; se vuelve a llamar después de un
+    error transitorio (`is_transient`) para no reutilizar un cliente roto, y
+    el lote espera con espera exponencial sin contar intentos. Cualquier otro
+    error se atribuye a las filas: el lote se reintenta fila por fila y las
+    que fallan `MAX_ATTEMPTS` veces pasan a `dead_letter`.
+    """
+
+    def __init__(
+        self,
+        connect,
+        table="responses",
+        path=DEFAULT_PATH,
+        is_transient=is_transient_error,
+        batch_size=BATCH_SIZE,
+        flush_interval=FLUSH_INTERVAL_SECONDS,
+        max_pending=MAX_PENDING,
+    ):
+        self.table = table
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.written = 0
+        self.failed_batches = 0
+        self.dead_letters = 0
+        self._connect = connect
+        self._client = None
+        self._is_transient = is_transient
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        # Momento (time.monotonic) antes del cual no se reintenta el envío
+        self._retry_at = 0.0
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL,"
+            " created REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            " id INTEGER PRIMARY KEY, payload TEXT NOT NULL,"
+            " created REAL NOT NULL, error TEXT NOT NULL)"
+        )
+        self._pending = self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+        self._thread = threading.Thread(target=self._run, name="supabase-writer", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def is_alive(self):
+        return self._thread.is_alive()
+
+    def submit(self, row):
+        """Agrega la fila a la cola local; retorna sin esperar a Supabase."""
+        payload = json.dumps(row, ensure_ascii=False, default=str)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise WriterOverloaded("La cola de escritura a Supabase está llena")
+            self._db.execute(
+                "INSERT INTO pending (payload, created) VALUES (?, ?)", (payload, time.time())
+            )
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._wakeup.set()
+
+    def replay_dead_letters(self, ids=None):
+        """
+        Devuelve a la cola las filas de `dead_letter` (todas, o las de `ids`)
+        con los intentos en cero; retorna cuántas se movieron.
+        """
+        filtro, parametros = "", ()
+        if ids is not None:
+            ids = list(ids)
+            filtro = f" WHERE id IN ({', '.join('?' * len(ids))})"
+            parametros = tuple(ids)
+        with self._lock:
+            self._db.execute("BEGIN")
+            filas = self._db.execute(
+                f"SELECT id, payload, created FROM dead_letter{filtro}", parametros
+            ).fetchall()
+            self._db.executemany(
+                "INSERT INTO pending (id, payload, created) VALUES (?, ?, ?)", filas
+            )
+            self._db.execute(f"DELETE FROM dead_letter{filtro}", parametros)
+            self._db.execute("COMMIT")
+            self._pending += len(filas)
+        if filas:
+            self._wakeup.set()
+        return len(filas)
+
+    def dead_letter_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+
+    def flush(self, timeout=10.0):
+        """Pide enviar la cola ya y espera hasta que quede vacía o pase `timeout`."""
+        limite = time.monotonic() + timeout
+        while self.pending and time.monotonic() < limite:
+            self._wakeup.set()
+            time.sleep(0.05)
+        return self.pending == 0
+
+    def close(self, timeout=10.0):
+        self.flush(timeout)
+        self._stopping.set()
+        self._wakeup.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "written": self.written,
+                "failed_batches": self.failed_batches,
+                "dead_letters": self.dead_letters,
+            }
+
+    def _run(self):
+        espera = 0.0
+        while not self._stopping.is_set():
+            pausa = self._retry_at - time.monotonic()
+            if pausa > 0:
+                # Tras una falla de Supabase se espera el plazo completo: los
+                # avisos de `submit` y `flush` no adelantan el reintento
+                self._stopping.wait(pausa)
+                continue
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            with self._lock:
+                lote = self._db.execute(
+                    "SELECT id, payload, attempts FROM pending ORDER BY id LIMIT ?",
+                    (self.batch_size,),
+                ).fetchall()
+            if not lote:
+                espera = 0.0
+                continue
+            if self._send(lote):
+                espera = 0.0
+                self._retry_at = 0.0
+                # Si quedó un lote completo esperando, se envía sin pausa
+                if self.pending >= self.batch_size:
+                    self._wakeup.set()
+            else:
+                espera = min(max(espera * 2, RETRY_BASE_SECONDS), RETRY_MAX_SECONDS)
+                self._retry_at = time.monotonic() + espera
+
+    def _send(self, lote):
+        """Envía un lote; retorna False si Supabase no estaba disponible."""
+        try:
+            self._insert([json.loads(payload) for _, payload, _ in lote])
+        except Exception as e:
+            with self._lock:
+                self.failed_batches += 1
+            if self._is_transient(e):
+                self._client = None
+                return False
+            if len(lote) == 1:
+                self._record_failure(lote[0], e)
+                return True
+            # Una fila inválida no debe bloquear a las demás del lote
+            for fila in lote:
+                if not self._send([fila]):
+                    return False
+            return True
+        with self._lock:
+            self._db.executemany("DELETE FROM pending WHERE id = ?", [(id_,) for id_, _, _ in lote])
+            self._pending -= len(lote)
+            self.written += len(lote)
+        return True
+
+    def _insert(self, rows):
+        if self._client is None:
+            self._client = self._connect()
+        with metrics.span("supabase_insert"):
+            self._client.table(self.table).insert(rows).execute()
+        metrics.inc("petscan_supabase_rows_total", len(rows), help="Filas insertadas en Supabase.")
+
+    def _record_failure(self, fila, error):
+        id_, payload, attempts = fila
+        with self._lock:
+            if attempts + 1 < MAX_ATTEMPTS:
+                self._db.execute("UPDATE pending SET attempts = attempts + 1 WHERE id = ?", (id_,))
+                return
+            self._db.execute("BEGIN")
+            self._db.execute(
+                "INSERT OR REPLACE INTO dead_letter (id, payload, created, error) VALUES (?, ?, ?, ?)",
+                (id_, payload, time.time(), f"{type(error).__name__}: {error}"),
+            )
+            self._db.execute("DELETE FROM pending WHERE id = ?", (id_,))
+            self._db.execute("COMMIT")
+            self._pending -= 1
+            self.dead_letters += 1
+
+
+def supabase_writer_from_config(config, path=DEFAULT_PATH):
+    """
+    Escritor de la tabla "responses" con las credenciales de la sección
+    [supabase] de los secrets.
+    """
+    def connect():
+        from supabase import create_client
+
+        return create_client(config["url"], config["key"])
+
+    return SupabaseWriter(connect, table="responses", path=path)
+
+
+def main(argv=None):
+    import tomllib
+
+    parser = argparse.ArgumentParser(description="Devuelve a la cola las filas rechazadas por Supabase.")
+    parser.add_argument("--queue", default=DEFAULT_PATH, help="cola local de filas para Supabase")
+    parser.add_argument("--secrets", default=os.path.join(".streamlit", "secrets.toml"))
+    parser.add_argument("--ids", type=int, nargs="+", help="solo estas filas de dead_letter")
+    args = parser.parse_args(argv)
+    with open(args.secrets, "rb") as archivo:
+        secrets = tomllib.load(archivo)
+
+    # Debe correr con la app (o batch.py) detenida: dos escritores sobre la
+    # misma cola enviarían las mismas filas dos veces
+    writer = supabase_writer_from_config(secrets["supabase"], args.queue)
+    movidas = writer.replay_dead_letters(args.ids)
+    print(f"{movidas} filas devueltas a la cola; enviando...", file=sys.stderr)
+    writer.close(timeout=60.0)
+    print(json.dumps({**writer.stats(), "dead_letter": writer.dead_letter_count()}))
+    return 0 if writer.pending == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+from questionnaire import SPECIES_QUESTIONS
+from triage import (
+    LEVEL_ROUTINE,
+    LEVEL_SOON,
+    LEVEL_URGENT,
+    SKIP_NEVER,
+    SKIP_ROUTINE,
+    SKIP_WHEN_OVERLOADED,
+    should_skip_llm,
+    triage,
+)
+
+
+def cat(**answers):
+    return {"tipo_animal": "Cat", "edad": 3, **answers}
+
+
+def dog(**answers):
+    return {"tipo_animal": "Perro", "edad": 3, **answers}
+
+
+def pain_face():
+    pregunta = next(q for q in SPECIES_QUESTIONS if q.field == "imagen_estado")
+    return pregunta.options[1]["en"]
+
+
+def test_no_signs_is_routine():
+    result = triage(cat(comida="Yes", acicala="Yes", reacio="No"))
+    assert result.level == LEVEL_ROUTINE
+    assert result.score == 0
+    assert result.reasons == ()
+
+
+def test_single_red_flag_is_urgent():
+    result = triage(dog(diarrhea_vomiting="Sí"))
+    assert result.level == LEVEL_URGENT
+    assert result.reasons == ("diarrhea_vomiting",)
+
+
+def test_cat_pain_face_is_urgent():
+    assert triage(cat(imagen_estado=pain_face())).level == LEVEL_URGENT
+
+
+def test_grooming_asked_three_ways_is_not_urgent():
+    result = triage(cat(acicala="No", grooming_regular="No", cambios_grooming="Yes"))
+    assert result.score == 3
+    assert result.level == LEVEL_SOON
+
+
+def test_senior_cat_with_mild_signs_is_not_urgent():
+    result = triage(cat(edad=10, ocultarse="Yes", comportamiento_cambio="Yes"))
+    assert result.score == 3
+    assert result.level == LEVEL_SOON
+
+
+def test_single_mild_sign_is_routine():
+    assert triage(dog(ocultarse="Sí")).level == LEVEL_ROUTINE
+
+
+def test_abnormal_elimination_asks_for_check_up():
+    assert triage(dog(eliminacion="No")).level == LEVEL_SOON
+
+
+def test_cat_only_rules_do_not_apply_to_dogs():
+    result = triage(dog(grooming_regular="No", cambios_grooming="Sí"))
+    assert result.reasons == ()
+
+
+def test_reasons_are_sorted_by_weight():
+    result = triage(cat(ocultarse="Yes", comida="No"))
+    assert result.reasons == ("comida", "ocultarse")
+    assert result.reason_texts("es") == ["No come ni bebe", "Se esconde o evita el contacto"]
+
+
+def test_invalid_age_is_ignored():
+    assert triage(cat(edad="?")).reasons == ()
+
+
+def test_should_skip_llm():
+    rutina = triage(cat())
+    urgente = triage(cat(comida="No"))
+    assert not should_skip_llm(rutina, SKIP_NEVER)
+    assert should_skip_llm(rutina, SKIP_ROUTINE)
+    assert not should_skip_llm(rutina, SKIP_ROUTINE, has_video=True)
+    assert not should_skip_llm(urgente, SKIP_ROUTINE)
+    assert not should_skip_llm(rutina, SKIP_WHEN_OVERLOADED, overloaded=False)
+    assert should_skip_llm(rutina, SKIP_WHEN_OVERLOADED, overloaded=True)
+    assert not should_skip_llm(urgente, SKIP_WHEN_OVERLOADED, overloaded=True)
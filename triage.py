@@ -0,0 +1,180 @@
+"""
+Triaje por reglas de las respuestas del cuestionario.
+
+Algunas respuestas ya indican por sí solas que la mascota necesita un
+veterinario (diarrea o vómito, gesto de dolor, no come, reacia a moverse);
+para ellas no hace falta esperar a Gemini. `triage` puntúa las respuestas
+con reglas fijas, sin red, y retorna el nivel de urgencia y la indicación
+estándar que la app muestra de inmediato, antes del análisis detallado.
+
+Las respuestas llegan como la opción mostrada en cualquier idioma, igual que
+las columnas de Supabase; cada regla se refiere a la pregunta y al índice de
+la opción en el esquema de questionnaire.py.
+"""
+from dataclasses import dataclass
+
+from questionnaire import (
+    CAT,
+    DIARRHEA_QUESTION,
+    GENERAL_QUESTIONS,
+    SPECIES_QUESTIONS,
+    species_code,
+)
+
+LEVEL_URGENT = "urgent"
+LEVEL_SOON = "soon"
+LEVEL_ROUTINE = "routine"
+
+# Peso de los signos de alarma: uno solo basta para que el caso sea urgente.
+# Los signos leves suman, pero sin un signo de alarma no pasan de `LEVEL_SOON`
+URGENT_SCORE = 3
+SOON_SCORE = 2
+
+SENIOR_AGE = 10
+
+# Políticas para omitir el análisis de Gemini en casos de rutina
+SKIP_NEVER = "never"
+SKIP_ROUTINE = "routine"
+SKIP_WHEN_OVERLOADED = "overload"
+
+
+@dataclass(frozen=True)
+class Rule:
+    field: str
+    # Índice de la opción (en `Question.options`) que suma `weight`
+    option: int
+    weight: int
+    reason: dict
+    species: str = None
+
+
+YES, NO = 0, 1
+
+RULES = (
+    Rule("diarrhea_vomiting", YES, 3, {"en": "Diarrhea or vomiting", "es": "Diarrea o vómito"}),
+    Rule("comida", NO, 3, {"en": "Not eating or drinking", "es": "No come ni bebe"}),
+    Rule("imagen_estado", 1, 3, {"en": "Facial signs of pain", "es": "Gesto de dolor"}, species=CAT),
+    Rule("reacio", YES, 3, {"en": "Reluctant to move", "es": "Reacio a moverse"}),
+    Rule("eliminacion", NO, 2, {"en": "Abnormal elimination", "es": "Eliminación anormal"}),
+    Rule("ocultarse", YES, 1, {"en": "Hiding or avoiding contact", "es": "Se esconde o evita el contacto"}),
+    Rule("comportamiento_cambio", YES, 1, {"en": "Recent change in behavior", "es": "Cambio reciente de comportamiento"}),
+    Rule("acicala", NO, 1, {"en": "Not grooming", "es": "No se acicala"}),
+    Rule("grooming_regular", NO, 1, {"en": "Not grooming regularly", "es": "No se acicala regularmente"}, species=CAT),
+    Rule("cambios_grooming", YES, 1, {"en": "Change in grooming", "es": "Cambio en el acicalamiento"}, species=CAT),
+    Rule("cambios_aseo", YES, 1, {"en": "Scratching more than usual", "es": "Se rasca más de lo común"}),
+)
+
+SENIOR_REASON = {"en": "Senior animal", "es": "Animal de edad avanzada"}
+
+LEVEL_TEXTS = {
+    LEVEL_URGENT: {
+        "label": {"en": "Urgent: see a veterinarian today", "es": "Urgente: consulte a un veterinario hoy"},
+        "guidance": {
+            "en": "The answers include signs that need prompt veterinary care. Contact your veterinarian or an "
+                  "emergency clinic today; do not give human medication and keep water available.",
+            "es": "Las respuestas incluyen signos que requieren atención veterinaria pronto. Comuníquese hoy con su "
+                  "veterinario o una clínica de urgencias; no le dé medicamentos de uso humano y mantenga agua disponible.",
+        },
+    },
+    LEVEL_SOON: {
+        "label": {"en": "Schedule a check-up", "es": "Programe una consulta"},
+        "guidance": {
+            "en": "Some answers deserve attention. Watch appetite, activity and elimination over the next days "
+                  "and book a check-up; go sooner if anything gets worse.",
+            "es": "Algunas respuestas merecen atención. Observe el apetito, la actividad y la eliminación en los "
+                  "próximos días y agende una consulta; adelántela si algo empeora.",
+        },
+    },
+    LEVEL_ROUTINE: {
+        "label": {"en": "No warning signs", "es": "Sin signos de alarma"},
+        "guidance": {
+            "en": "The answers do not show warning signs. Keep up routine care and regular veterinary check-ups.",
+            "es": "Las respuestas no muestran signos de alarma. Mantenga los cuidados habituales y los controles "
+                  "veterinarios periódicos.",
+        },
+    },
+}
+
+_QUESTIONS = {(q.field, q.species): q for q in (*GENERAL_QUESTIONS, DIARRHEA_QUESTION, *SPECIES_QUESTIONS)}
+
+
+@dataclass(frozen=True)
+class TriageResult:
+    score: int
+    level: str
+    # Campos de las reglas que se cumplieron, de mayor a menor peso
+    reasons: tuple
+
+    def label(self, lang):
+        return LEVEL_TEXTS[self.level]["label"][lang]
+
+    def guidance(self, lang):
+        return LEVEL_TEXTS[self.level]["guidance"][lang]
+
+    def reason_texts(self, lang):
+        textos = {rule.field: rule.reason[lang] for rule in RULES}
+        textos["edad"] = SENIOR_REASON[lang]
+        return [textos[campo] for campo in self.reasons]
+
+    def as_row(self):
+        """Columnas de Supabase con el resultado del triaje."""
+        return {
+            "triage_level": self.level,
+            "triage_score": self.score,
+            "triage_reasons": list(self.reasons),
+        }
+
+
+def _question(field, species):
+    return _QUESTIONS.get((field, species)) or _QUESTIONS.get((field, None))
+
+
+def _matches(question, value, option):
+    return question is not None and value in question.options[option].values()
+
+
+def triage(answers):
+    """
+    Nivel de urgencia de `answers` (campo -> opción mostrada). Cualquier
+    regla de peso `URGENT_SCORE` basta para que el caso sea urgente; varias
+    reglas leves (que a menudo son el mismo signo preguntado de otra forma)
+    solo piden una consulta.
+    """
+    especie = species_code(answers["tipo_animal"])
+    cumplidas = []
+    for rule in RULES:
+        if rule.species not in (None, especie) or rule.field not in answers:
+            continue
+        if _matches(_question(rule.field, especie), answers[rule.field], rule.option):
+            cumplidas.append((rule.weight, rule.field))
+    try:
+        if int(answers.get("edad", 0)) >= SENIOR_AGE:
+            cumplidas.append((1, "edad"))
+    except (TypeError, ValueError):
+        pass
+
+    cumplidas.sort(key=lambda regla: -regla[0])
+    score = sum(peso for peso, _ in cumplidas)
+    if cumplidas and cumplidas[0][0] >= URGENT_SCORE:
+        level = LEVEL_URGENT
+    elif score >= SOON_SCORE:
+        level = LEVEL_SOON
+    else:
+        level = LEVEL_ROUTINE
+    return TriageResult(score=score, level=level, reasons=tuple(campo for _, campo in cumplidas))
+
+
+def should_skip_llm(result, policy, has_video=False, overloaded=False):
+    """
+    Decide si se omite el análisis de Gemini según `policy`: nunca, siempre
+    en los casos de rutina, o solo en los de rutina cuando el pool de keys
+    está saturado. Con video nunca se omite, porque el video puede mostrar
+    algo que las respuestas no dicen.
+    """
+    if has_video or result.level != LEVEL_ROUTINE:
+        return False
+    if policy == SKIP_ROUTINE:
+        return True
+    if policy == SKIP_WHEN_OVERLOADED:
+        return overloaded
+    return False
@@ -0,0 +1,110 @@
+"""
+Caché de videos subidos a Gemini, indexada por el hash del contenido.
+
+Streamlit vuelve a ejecutar APP.py con cada cambio de un widget; sin esta
+caché cada rerun volvía a escribir el archivo temporal, a subirlo y a esperar
+su procesamiento. Aquí se guarda, por hash SHA-256 de los bytes del video, el
+archivo ya activo en Gemini para reutilizar su `uri` sin llamadas de red.
+"""
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+
+# Gemini elimina los archivos subidos a las 48 horas. Se descartan un poco
+# antes para no entregar una uri que expire a mitad de una evaluación.
+GEMINI_FILE_TTL_SECONDS = 48 * 60 * 60
+EXPIRY_MARGIN_SECONDS = 60 * 60
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class CachedUpload:
+    digest: str
+    name: str
+    uri: str
+    mime_type: str
+    expires_at: float
+    key_alias: str = ""
+    # Duración de cada etapa de la subida (escritura, pre-procesamiento,
+    # subida, activación), para guardarla con la evaluación que la esperó
+    timings: dict = field(default_factory=dict, compare=False)
+
+    def expired(self, now=None):
+        now = time.time() if now is None else now
+        return now >= self.expires_at - EXPIRY_MARGIN_SECONDS
+
+
+def hash_video_bytes(buffer):
+    """
+    Calcula el SHA-256 de un archivo subido leyendo por bloques, sin copiar
+    el video completo en memoria otra vez.
+    """
+    digest = hashlib.sha256()
+    buffer.seek(0)
+    for bloque in iter(lambda: buffer.read(HASH_CHUNK_SIZE), b""):
+        digest.update(bloque)
+    buffer.seek(0)
+    return digest.hexdigest()
+
+
+def _expiration_timestamp(file):
+    """Usa la expiración que reporta Gemini y, si no existe, el TTL por defecto."""
+    expiration = getattr(file, "expiration_time", None)
+    if expiration is not None:
+        try:
+            return expiration.timestamp()
+        except (AttributeError, OverflowError, ValueError):
+            pass
+    return time.time() + GEMINI_FILE_TTL_SECONDS
+
+
+class UploadCache:
+    """
+    Registro de archivos subidos compartido por todas las sesiones del proceso.
+
+    Las entradas vencidas se eliminan al consultarlas y al insertar nuevas; si
+    se supera `max_entries` se descartan primero las que expiran antes.
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, digest):
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None and entry.expired():
+                del self._entries[digest]
+                entry = None
+            return entry
+
+    def put(self, digest, file, mime_type, key_alias="", timings=None):
+        entry = CachedUpload(
+            digest=digest,
+            name=file.name,
+            uri=file.uri,
+            mime_type=mime_type,
+            expires_at=_expiration_timestamp(file),
+            key_alias=key_alias,
+            timings=dict(timings or {}),
+        )
+        with self._lock:
+            self._entries[digest] = entry
+            self._evict()
+        return entry
+
+    def discard(self, digest):
+        with self._lock:
+            self._entries.pop(digest, None)
+
+    def _evict(self):
+        now = time.time()
+        for digest in [d for d, e in self._entries.items() if e.expired(now)]:
+            del self._entries[digest]
+        if len(self._entries) > self.max_entries:
+            sobrantes = sorted(self._entries.values(), key=lambda e: e.expires_at)
+            for entry in sobrantes[: len(self._entries) - self.max_entries]:
+                del self._entries[entry.digest]
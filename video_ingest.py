@@ -0,0 +1,173 @@
+"""
+Validación y escritura a disco de los videos subidos por el usuario.
+
+El video se copia por bloques desde el buffer del uploader, sin crear una
+segunda copia completa en memoria. El tipo MIME se detecta por el contenido
+(no por la extensión) y los límites de tamaño y duración se aplican antes de
+subir nada a Gemini. Los archivos temporales viven en un directorio de spool
+con un tope de espacio en disco y se eliminan apenas termina la subida.
+"""
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+MAX_VIDEO_BYTES = 200 * 1024 * 1024
+MAX_VIDEO_SECONDS = 3 * 60
+SPOOL_MAX_BYTES = 2 * 1024 * 1024 * 1024
+# Archivos que quedaron de un proceso anterior se consideran abandonados
+SPOOL_STALE_SECONDS = 6 * 60 * 60
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class VideoRejected(Exception):
+    """El video no cumple los requisitos para enviarse a Gemini."""
+
+
+def _read_at(buffer, offset, size):
+    buffer.seek(offset)
+    return buffer.read(size)
+
+
+def _mp4_duration(buffer, total_size):
+    """
+    Duración en segundos según la caja `mvhd` de un MP4/MOV. Solo se leen
+    los encabezados de las cajas, así que funciona aunque `moov` esté al final.
+    """
+    def boxes(start, end):
+        offset = start
+        while offset + 8 <= end:
+            header = _read_at(buffer, offset, 16)
+            if len(header) < 8:
+                return
+            size, kind = struct.unpack(">I4s", header[:8])
+            header_size = 8
+            if size == 1 and len(header) == 16:
+                size = struct.unpack(">Q", header[8:16])[0]
+                header_size = 16
+            elif size == 0:
+                size = end - offset
+            if size < header_size:
+                return
+            yield kind, offset + header_size, offset + size
+            offset += size
+
+    for kind, start, end in boxes(0, total_size):
+        if kind != b"moov":
+            continue
+        for child, child_start, _ in boxes(start, end):
+            if child != b"mvhd":
+                continue
+            version = _read_at(buffer, child_start, 1)
+            if version == b"\x01":
+                timescale, duration = struct.unpack(">IQ", _read_at(buffer, child_start + 20, 12))
+            else:
+                timescale, duration = struct.unpack(">II", _read_at(buffer, child_start + 12, 8))
+            return duration / timescale if timescale else None
+    return None
+
+
+def _avi_duration(header):
+    """Duración en segundos según el encabezado `avih` de un AVI."""
+    if header[12:16] != b"LIST" or header[20:24] != b"hdrl" or header[24:28] != b"avih":
+        return None
+    microseconds_per_frame, = struct.unpack("<I", header[32:36])
+    total_frames, = struct.unpack("<I", header[48:52])
+    return microseconds_per_frame * total_frames / 1_000_000
+
+
+def inspect_video(buffer, size):
+    """
+    Detecta el tipo MIME por los bytes iniciales y aplica los límites de
+    tamaño y duración. Retorna `(mime_type, sufijo)` o lanza `VideoRejected`.
+    """
+    if size > MAX_VIDEO_BYTES:
+        raise VideoRejected(
+            f"El video pesa {size / 1024 / 1024:.0f} MB; el máximo es {MAX_VIDEO_BYTES // 1024 // 1024} MB."
+        )
+
+    header = _read_at(buffer, 0, 64)
+    if header[4:8] == b"ftyp":
+        brand = header[8:12]
+        if brand == b"qt  ":
+            mime_type, suffix = "video/mov", ".mov"
+        elif brand.startswith(b"3g"):
+            mime_type, suffix = "video/3gpp", ".3gp"
+        else:
+            mime_type, suffix = "video/mp4", ".mp4"
+        duration = _mp4_duration(buffer, size)
+    elif header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+        mime_type, suffix = "video/avi", ".avi"
+        duration = _avi_duration(header)
+    else:
+        buffer.seek(0)
+        raise VideoRejected("El archivo no es un video MP4, MOV o AVI válido.")
+    buffer.seek(0)
+
+    if duration is not None and duration > MAX_VIDEO_SECONDS:
+        raise VideoRejected(
+            f"El video dura {duration:.0f} segundos; el máximo es {MAX_VIDEO_SECONDS} segundos."
+        )
+    return mime_type, suffix
+
+
+class VideoSpool:
+    """
+    Directorio de archivos temporales con un tope de bytes en disco.
+
+    `write` reserva el espacio antes de copiar y `release` borra el archivo y
+    libera la reserva. Al crearse se eliminan los archivos abandonados.
+    """
+
+    def __init__(self, directory=None, max_bytes=SPOOL_MAX_BYTES):
+        self.directory = directory or os.path.join(tempfile.gettempdir(), "petscan-videos")
+        self.max_bytes = max_bytes
+        self._reserved = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._remove_stale()
+
+    @property
+    def used_bytes(self):
+        with self._lock:
+            return sum(self._reserved.values())
+
+    def write(self, buffer, size, suffix):
+        with self._lock:
+            if sum(self._reserved.values()) + size > self.max_bytes:
+                raise VideoRejected("El servidor está procesando demasiados videos; intente de nuevo en unos minutos.")
+            fd, path = tempfile.mkstemp(suffix=suffix, dir=self.directory)
+            self._reserved[path] = size
+        try:
+            buffer.seek(0)
+            with os.fdopen(fd, "wb") as temp_file:
+                shutil.copyfileobj(buffer, temp_file, COPY_CHUNK_SIZE)
+            buffer.seek(0)
+        except BaseException:
+            self.release(path)
+            raise
+        return path
+
+    def adopt(self, path):
+        """Registra en el spool un archivo derivado creado dentro del directorio."""
+        with self._lock:
+            self._reserved[path] = os.path.getsize(path)
+
+    def release(self, path):
+        with self._lock:
+            self._reserved.pop(path, None)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_stale(self):
+        limite = time.time() - SPOOL_STALE_SECONDS
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < limite:
+                    os.remove(entry.path)
+            except OSError:
+                pass
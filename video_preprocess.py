@@ -0,0 +1,161 @@
+"""
+Pre-procesamiento local de los videos antes de subirlos a Gemini.
+
+Los criterios de evaluación solo necesitan ver la cara, las orejas y los
+bigotes del animal, así que no hace falta subir el video original en 4K:
+
+- "proxy": se transcodifica a baja resolución y pocos cuadros por segundo,
+  sin audio.
+- "keyframes": se extraen cuadros candidatos, se eligen los más nítidos de
+  cada tramo del video y se arma con ellos una sola imagen en cuadrícula.
+
+Las funciones públicas de este módulo se ejecutan en un pool de procesos
+(deben poder serializarse), y usan el binario `ffmpeg` si está instalado.
+"""
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+
+from video_ingest import MAX_VIDEO_SECONDS
+
+MODE_OFF = "off"
+MODE_PROXY = "proxy"
+MODE_KEYFRAMES = "keyframes"
+
+# El proxy cubre todo lo que video_ingest acepta: recortar más dejaría sin
+# analizar parte del video sin que el usuario lo sepa
+PROXY_MAX_SECONDS = MAX_VIDEO_SECONDS
+PROXY_HEIGHT = 480
+PROXY_FPS = 2
+
+KEYFRAME_COUNT = 6
+KEYFRAME_COLUMNS = 3
+KEYFRAME_HEIGHT = 360
+KEYFRAME_CANDIDATES_PER_SECOND = 4
+
+FFMPEG_TIMEOUT_SECONDS = 120
+
+
+class PreprocessError(Exception):
+    """ffmpeg no pudo procesar el video."""
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def _run_ffmpeg(args):
+    try:
+        subprocess.run(
+            ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", *args],
+            check=True,
+            capture_output=True,
+            timeout=FFMPEG_TIMEOUT_SECONDS,
+        )
+    except subprocess.CalledProcessError as e:
+        raise PreprocessError(e.stderr.decode(errors="replace").strip()) from e
+    except subprocess.TimeoutExpired as e:
+        raise PreprocessError("ffmpeg tardó demasiado en procesar el video") from e
+
+
+def make_proxy(src, dst, max_seconds=PROXY_MAX_SECONDS, height=PROXY_HEIGHT, fps=PROXY_FPS):
+    """
+    Escribe en `dst` un MP4 recortado a `max_seconds`, de `height` píxeles de
+    alto y `fps` cuadros por segundo, sin audio. Retorna `dst`.
+    """
+    _run_ffmpeg([
+        "-i", src,
+        "-t", str(max_seconds),
+        "-vf", f"scale=-2:'min({height},ih)',fps={fps}",
+        "-an",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", "28",
+        "-pix_fmt", "yuv420p",
+        "-movflags", "+faststart",
+        dst,
+    ])
+    return dst
+
+
+def _sharpness(image):
+    """Varianza de los bordes: más alta cuanto más nítido es el cuadro."""
+    from PIL import ImageFilter, ImageStat
+
+    bordes = image.convert("L").filter(ImageFilter.FIND_EDGES)
+    return ImageStat.Stat(bordes).var[0]
+
+
+def make_keyframe_sheet(
+    src,
+    dst,
+    count=KEYFRAME_COUNT,
+    columns=KEYFRAME_COLUMNS,
+    height=KEYFRAME_HEIGHT,
+    max_seconds=PROXY_MAX_SECONDS,
+):
+    """
+    Escribe en `dst` un JPEG en cuadrícula con los `count` cuadros más
+    nítidos, uno por cada tramo de igual duración del video. Retorna `dst`.
+    """
+    from PIL import Image
+
+    with tempfile.TemporaryDirectory() as frames_dir:
+        _run_ffmpeg([
+            "-i", src,
+            "-t", str(max_seconds),
+            "-vf", f"fps={KEYFRAME_CANDIDATES_PER_SECOND},scale=-2:'min({height},ih)'",
+            "-q:v", "3",
+            os.path.join(frames_dir, "frame%04d.jpg"),
+        ])
+        nombres = sorted(os.listdir(frames_dir))
+        if not nombres:
+            raise PreprocessError("No se pudo extraer ningún cuadro del video")
+
+        count = min(count, len(nombres))
+        tramo = len(nombres) / count
+        elegidos = []
+        for i in range(count):
+            candidatos = nombres[int(i * tramo):max(int((i + 1) * tramo), int(i * tramo) + 1)]
+            mejor, mejor_nitidez = None, -1.0
+            for nombre in candidatos:
+                with Image.open(os.path.join(frames_dir, nombre)) as frame:
+                    nitidez = _sharpness(frame)
+                    if nitidez > mejor_nitidez:
+                        mejor, mejor_nitidez = frame.convert("RGB"), nitidez
+            elegidos.append(mejor)
+
+    ancho = max(frame.width for frame in elegidos)
+    alto = max(frame.height for frame in elegidos)
+    columns = min(columns, len(elegidos))
+    filas = math.ceil(len(elegidos) / columns)
+    hoja = Image.new("RGB", (ancho * columns, alto * filas))
+    for i, frame in enumerate(elegidos):
+        hoja.paste(frame, ((i % columns) * ancho, (i // columns) * alto))
+    hoja.save(dst, format="JPEG", quality=85)
+    return dst
+
+
+def preprocess_video(src, dst_dir, mode):
+    """
+    Ejecuta el modo de pre-procesamiento sobre `src` y retorna
+    `(ruta, mime_type)` del archivo resultante, creado dentro de `dst_dir`.
+    Cualquier falla al procesar el video se entrega como `PreprocessError`.
+    """
+    if mode == MODE_PROXY:
+        suffix, mime_type, fn = ".mp4", "video/mp4", make_proxy
+    elif mode == MODE_KEYFRAMES:
+        suffix, mime_type, fn = ".jpg", "image/jpeg", make_keyframe_sheet
+    else:
+        raise ValueError(f"Modo de pre-procesamiento desconocido: {mode}")
+    fd, dst = tempfile.mkstemp(suffix=suffix, dir=dst_dir)
+    os.close(fd)
+    try:
+        fn(src, dst)
+    except BaseException as e:
+        os.remove(dst)
+        if isinstance(e, Exception) and not isinstance(e, PreprocessError):
+            # Errores de PIL o del disco: quien llama sube el video original
+            raise PreprocessError(f"{type(e).__name__}: {e}") from e
+        raise
+    return dst, mime_type